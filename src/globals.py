@@ -40,11 +40,71 @@ API.project.update_meta(DST_PROJECT_ID, PROJECT_META.to_json())
 CACHED_PROJECT_DIR: str = _get_cache_dir(PROJECT_ID)
 PROJECT_DIR: str = os.path.join(APP_DATA_DIR, "sly_project")
 SPLIT_PROJECT_DIR: str = os.path.join(APP_DATA_DIR, "sly_split")
+MEDIA_CACHE_DIR: str = os.path.join(APP_DATA_DIR, "media_cache")
+CLIP_MANIFEST_DIR: str = os.path.join(SPLIT_PROJECT_DIR, "clip_manifest")
+ITEM_INDEX_PATH: str = os.path.join(APP_DATA_DIR, f"[{PROJECT_ID}] item_index.json")
+CLIP_PLAN_PATH: str = os.path.join(SPLIT_PROJECT_DIR, "clip_plan.json")
+DRY_RUN_PLAN_PATH: str = os.path.join(SPLIT_PROJECT_DIR, "clip_plan_dry_run.json")
 
 # Application settings
 USE_CACHE: bool = True
 SESSION_ID: int = None
 SPLIT_RATIO: float = 0.8
+# Videos are assigned to train by a hash of their id; change the salt to draw a new split
+SPLIT_SALT: str = ""
+# Videos processed in parallel when making clips, ffmpeg threads are split between them
+CLIP_WORKERS: int = max(1, (os.cpu_count() or 1) // 8)
+# Short edge of the training clips in pixels
+CLIP_SHORT_EDGE: int = 480
+# Cut clips with -c copy when the source needs no scaling and the clip starts on a keyframe
+STREAM_COPY_CLIPS: bool = True
+# Transcode each training video once to the clip size and cut all its clips from that proxy
+USE_PROXY: bool = False
+# Encoder settings of transcoded clips, one of clip_extraction.ENCODING_PROFILES
+ENCODING_PROFILE: str = "fast"
+# Seed of negative clip sampling, the same seed and inputs give the same clip plan
+CLIP_PLAN_SEED: int = 0
+# Only plan the clips and report how much would be encoded, nothing is encoded or uploaded
+DRY_RUN: bool = False
+# "ffmpeg" runs one subprocess per decode pass, "pyav" decodes in-process (needs av>=13.0,<19.0)
+EXTRACTION_BACKEND: str = "ffmpeg"
+# Disk budget for intermediate files (downloads, split copies, clips), None for no limit.
+# Over budget, downloading stops and the videos so far are clipped and uploaded before
+# the next round of downloads; negative clip length is then averaged per round.
+# Clip making pauses while over budget until uploaded clips are released. Kept clips and
+# proxies (DELETE_UPLOADED_CLIPS, DELETE_PROXIES off) keep counting toward the budget
+SCRATCH_BUDGET_GB: float = None
+# Delete downloads and split copies as soon as their last consumer is done
+EAGER_CLEANUP: bool = True
+# Delete clips once uploaded. Turn off to keep them for restarts and later runs with another
+# plan, which reuse them through their manifests, at the cost of disk space that only grows
+DELETE_UPLOADED_CLIPS: bool = True
+# Delete the proxy of a video once its clips are made. Turn off to keep proxies cached across
+# runs, so later runs cut their clips without transcoding again, at the cost of disk space
+DELETE_PROXIES: bool = True
+# Upload clips of finished videos while the next videos are still being encoded
+STREAM_UPLOADS: bool = True
+# Per-video clip batches waiting for upload before clip making blocks
+UPLOAD_QUEUE_SIZE: int = 4
+# Upload batches in flight at once. Batches start at UPLOAD_BATCH_SIZE items and are resized
+# to take about UPLOAD_TARGET_BATCH_SECONDS each, within UPLOAD_MAX_BATCH_SIZE items and MB
+UPLOAD_WORKERS: int = 4
+UPLOAD_BATCH_SIZE: int = 10
+UPLOAD_MAX_BATCH_SIZE: int = 50
+UPLOAD_MAX_BATCH_MB: int = 512
+UPLOAD_TARGET_BATCH_SECONDS: float = 10.0
+# Upload clips whose content hash the server already stores by hash instead of sending the bytes
+DEDUPE_CLIP_UPLOADS: bool = True
+# Keep video files in the local mirror of the destination project. Without them the mirror
+# holds only item infos and annotations, refreshed incrementally from the server item lists
+MIRROR_DST_VIDEO_FILES: bool = False
+# Source videos downloaded at once over one connection pool, and the read size of each transfer
+DOWNLOAD_WORKERS: int = 4
+DOWNLOAD_CHUNK_SIZE_MB: int = 8
+# Check the hash of downloaded videos, not only their size
+VERIFY_DOWNLOAD_HASH: bool = True
+# Videos downloaded ahead of the one being split and probed, so network and CPU time overlap
+PREFETCH_LOOKAHEAD: int = 2
 
 # Progress indicators
 PROGRESS_BAR_PROJECT: Progress = Progress()
@@ -4,10 +4,9 @@ from supervisely.app.widgets import Container, Stepper
 import src.globals as g
 import src.ui.utils as utils
 from src.scripts.apply_detector import apply_detector
-from src.scripts.download_project import download_dst_project, download_project
-from src.scripts.make_training_clips import make_training_clips
+from src.scripts.download_project import Prefetcher, download_dst_project
 from src.scripts.split_project import split_project
-from src.scripts.upload_project import upload_project
+from src.scripts.upload_project import make_and_upload_project
 from src.ui.connect import connect
 from src.ui.input import input
 from src.ui.output import output
@@ -78,19 +77,21 @@ def process_project():
         download_dst_project()
 
         if len(g.VIDEOS_TO_UPLOAD) > 0:
-            # 1. Download only new videos
-            download_project()
-
-            # 2. Split new videos into train/test
-            split_project()
-
-            # 3. Create clips from new videos
-            make_training_clips()
-
-            # 4. Upload new videos and clips
-            upload_project()
-
-        if len(g.VIDEOS_TO_DETECT) > 0:
+            # a dry run releases nothing, so it never splits the videos into rounds
+            prefetcher = Prefetcher(
+                g.VIDEOS_TO_UPLOAD, g.PREFETCH_LOOKAHEAD, budget_rounds=not g.DRY_RUN
+            )
+            while prefetcher.remaining:
+                # 1-2. Download only new videos and split them into train/test as they arrive
+                split_project(prefetcher.next_round())
+
+                # 3-4. Create clips from new videos and upload them with the test videos
+                # a round of a run split by the scratch budget may have no positives
+                make_and_upload_project(
+                    require_positives=prefetcher.rounds == 1 and not prefetcher.remaining
+                )
+
+        if len(g.VIDEOS_TO_DETECT) > 0 and not g.DRY_RUN:
             # 5. Apply detector to new videos
             apply_detector()
 
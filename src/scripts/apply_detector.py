@@ -3,9 +3,8 @@ from supervisely.annotation.annotation import Annotation, ObjClassCollection
 from supervisely.annotation.obj_class import ObjClass
 from supervisely.api.video.video_api import VideoInfo
 from supervisely.geometry.rectangle import Rectangle
-from supervisely.io.fs import mkdir
+from supervisely.io.json import dump_json_file
 from supervisely.nn.model.model_api import ModelAPI
-from supervisely.project.project import OpenMode
 from supervisely.project.video_project import VideoDataset, VideoProject
 from supervisely.video_annotation.frame import Frame
 from supervisely.video_annotation.video_annotation import (
@@ -18,7 +17,7 @@ from supervisely.video_annotation.video_object import VideoObject
 
 import src.globals as g
 from src.scripts.cache import update_detection_status
-from src.scripts.download_project import download_dst_project
+from src.scripts.dst_index import dst_index
 
 
 def filter_annotation_by_classes(annotation_predictions: dict, selected_classes: list) -> dict:
@@ -88,17 +87,8 @@ def apply_detector():
     if mouse_obj_class is None:
         update_dst_project_meta()
 
-    # to ensure that the dst project is up to date
-    download_dst_project()
-
-    try:
-        # @TODO: READ project always fails
-        dst_project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.READ)
-        logger.info("Destination project cache found")
-    except:
-        logger.info("Destination project cache not found, creating new one")
-        mkdir(g.DST_PROJECT_PATH, True)
-        dst_project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.CREATE)
+    # the mirror and the destination index are kept up to date by the upload stages
+    dst_project_fs = dst_index.project_fs
     dst_project_fs.set_meta(g.DST_PROJECT_META)
 
     datasets = []
@@ -109,12 +99,6 @@ def apply_detector():
         extra={"datasets": datasets},
     )
 
-    video_id_to_dataset = {}
-    for dataset in dst_project_fs.datasets:
-        for video_name, _, _ in dataset.items():
-            video_info = dataset.get_item_info(video_name)
-            video_id_to_dataset[video_info.id] = dataset
-
     with g.PROGRESS_BAR(message="Detecting videos", total=len(g.VIDEOS_TO_DETECT)) as pbar:
         g.PROGRESS_BAR.show()
         for video in g.VIDEOS_TO_DETECT:
@@ -145,9 +129,15 @@ def apply_detector():
             g.API.video.annotation.append(video_id, video_annotation, None, progress_cb)
 
             video_info = g.API.video.get_info_by_id(video_id)
-
-            dataset: VideoDataset = video_id_to_dataset[video.id]
-            dataset.add_item_file(video.name, None, video_annotation, item_info=video_info)
+            dst_index.add(video_info)
+
+            dataset: VideoDataset = dst_index.get_dataset_fs(video_info.dataset_id)
+            if dataset.item_exists(video.name):
+                # update in place, deleting the item would delete its mirrored video file
+                dataset.set_ann(video.name, video_annotation)
+                dump_json_file(video_info._asdict(), dataset.get_item_info_path(video.name))
+            else:
+                dataset.add_item_file(video.name, None, video_annotation, item_info=video_info)
 
             update_detection_status(str(video_id))
 
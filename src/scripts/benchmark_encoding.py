@@ -0,0 +1,151 @@
+"""Encode a reference segment with every encoding profile and compare the results.
+
+Usage:
+    python -m src.scripts.benchmark_encoding VIDEO [--start SEC] [--duration SEC] [--size 480]
+
+Does not import src.globals, so it runs without an app session.
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from src.scripts.clip_extraction import (
+    ENCODING_PROFILES,
+    EncodingProfile,
+    calculate_resize,
+    encode_segment,
+)
+from src.scripts.media_probe import FrameIndex, probe_frame_index, probe_video
+
+
+def _decode_seconds(clip_path: Path) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(clip_path), "-f", "null", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def benchmark_profile(
+    video_path: Path,
+    profile: EncodingProfile,
+    start_frame: int,
+    end_frame: int,
+    width: int,
+    height: int,
+    fps: float,
+    work_dir: str,
+    threads: Optional[int] = None,
+    frame_index: Optional[FrameIndex] = None,
+) -> dict:
+    clip_path = Path(work_dir, f"{profile.name}.mp4")
+    started = time.perf_counter()
+    encode_segment(
+        video_path,
+        start_frame,
+        end_frame,
+        clip_path,
+        width,
+        height,
+        fps,
+        threads,
+        profile,
+        frame_index,
+    )
+    encode_seconds = time.perf_counter() - started
+    decode_seconds = _decode_seconds(clip_path)
+
+    frames = end_frame - start_frame + 1
+    size = os.path.getsize(clip_path)
+    return {
+        "profile": profile.name,
+        "encode_fps": frames / encode_seconds,
+        "bytes_per_second": size / (frames / fps),
+        "decode_fps": frames / decode_seconds,
+        "size": size,
+    }
+
+
+def run_benchmark(
+    video_path: str,
+    start: float = 0.0,
+    duration: float = 5.0,
+    short_edge: int = 480,
+    profiles: Optional[List[str]] = None,
+    threads: Optional[int] = None,
+) -> List[dict]:
+    media_info = probe_video(video_path)
+    fps = media_info.fps
+    start_frame = int(start * fps)
+    end_frame = min(media_info.total_frames - 1, start_frame + int(duration * fps) - 1)
+    if end_frame < start_frame:
+        raise ValueError(f"Segment starts after the end of '{video_path}'")
+    width, height = calculate_resize(media_info.width, media_info.height, short_edge)
+    frame_index = probe_frame_index(video_path)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in profiles or list(ENCODING_PROFILES):
+            results.append(
+                benchmark_profile(
+                    Path(video_path),
+                    ENCODING_PROFILES[name],
+                    start_frame,
+                    end_frame,
+                    width,
+                    height,
+                    fps,
+                    work_dir,
+                    threads,
+                    frame_index,
+                )
+            )
+    return results
+
+
+def format_results(results: List[dict]) -> str:
+    lines = [
+        f"{'profile':<14}{'encode fps':>12}{'KB/s video':>12}{'decode fps':>12}{'size KB':>10}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['profile']:<14}"
+            f"{result['encode_fps']:>12.1f}"
+            f"{result['bytes_per_second'] / 1024:>12.1f}"
+            f"{result['decode_fps']:>12.1f}"
+            f"{result['size'] / 1024:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark clip encoding profiles")
+    parser.add_argument("video", help="source video")
+    parser.add_argument("--start", type=float, default=0.0, help="segment start, seconds")
+    parser.add_argument("--duration", type=float, default=5.0, help="segment length, seconds")
+    parser.add_argument("--size", type=int, default=480, help="short edge of the clips")
+    parser.add_argument("--threads", type=int, default=None, help="ffmpeg threads")
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        choices=list(ENCODING_PROFILES),
+        default=None,
+        help="profiles to compare, all by default",
+    )
+    args = parser.parse_args()
+    results = run_benchmark(
+        args.video, args.start, args.duration, args.size, args.profiles, args.threads
+    )
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
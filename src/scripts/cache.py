@@ -114,17 +114,14 @@ def add_videos_to_cache(
     upload_cache()
 
 
-def add_single_clip_to_cache(clip_info: VideoMetaData) -> None:
-    if not hasattr(clip_info, "source_video") or not clip_info.source_video:
-        logger.warning(f"Clip {clip_info.name} has no source video")
-        return
-
-    cache_data = load_cache()
+def _add_clip(cache_data: Dict[str, Any], clip_info: VideoMetaData) -> Dict[str, Any]:
+    """Add one clip to cache_data, returns the cache data to continue with."""
     source_video = clip_info.source_video
     video_id = str(source_video.video_id)
 
     if video_id not in cache_data.get("videos", {}):
-        add_video_to_cache(source_video)
+        save_cache(cache_data)
+        add_video_to_cache(source_video, upload=False)
         cache_data = load_cache()
 
     clip_id = str(getattr(clip_info, "clip_id", hash(clip_info.name)))
@@ -146,6 +143,21 @@ def add_single_clip_to_cache(clip_info: VideoMetaData) -> None:
         }
 
     cache_data["videos"][video_id].setdefault("clips", {})[clip_id] = clip_data
+    return cache_data
+
+
+def add_single_clip_to_cache(clip_info: VideoMetaData) -> None:
+    add_clip_batch_to_cache([clip_info])
+
+
+def add_clip_batch_to_cache(clip_infos: List[VideoMetaData]) -> None:
+    """Add uploaded clips with one save and one upload of the cache."""
+    cache_data = load_cache()
+    for clip_info in clip_infos:
+        if not hasattr(clip_info, "source_video") or not clip_info.source_video:
+            logger.warning(f"Clip {clip_info.name} has no source video")
+            continue
+        cache_data = _add_clip(cache_data, clip_info)
 
     save_cache(cache_data)
     upload_cache()
@@ -0,0 +1,384 @@
+import os
+import subprocess
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from supervisely import logger
+
+from src.scripts.media_probe import FrameIndex, MediaInfo
+
+# Clip encoders fed from a single decode pass
+MAX_OUTPUTS_PER_PASS = 16
+# Start a new decode pass instead of decoding a gap longer than this (seconds)
+MAX_GAP_DURATION = 30
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """x264 settings of transcoded clips. gop_duration=0 makes every frame a keyframe."""
+
+    name: str
+    preset: str
+    crf: int
+    gop_duration: float
+    tune: Optional[str] = None
+
+    def encoder_args(self) -> list:
+        # keyframes are forced by time, so the GOP length follows the fps of every source
+        args = [
+            "-c:v",
+            "libx264",
+            "-preset",
+            self.preset,
+            "-crf",
+            str(self.crf),
+            "-pix_fmt",
+            "yuv420p",
+            "-force_key_frames",
+            f"expr:gte(t,n_forced*{self.gop_duration})",
+        ]
+        if self.tune:
+            args += ["-tune", self.tune]
+        return args
+
+
+ENCODING_PROFILES = {
+    profile.name: profile
+    for profile in [
+        # the original settings: every frame is a keyframe
+        EncodingProfile("intra", preset="fast", crf=20, gop_duration=0),
+        EncodingProfile("fast", preset="fast", crf=20, gop_duration=1),
+        EncodingProfile("balanced", preset="medium", crf=22, gop_duration=2),
+        EncodingProfile("small", preset="slow", crf=24, gop_duration=5),
+        EncodingProfile("fast_decode", preset="fast", crf=20, gop_duration=1, tune="fastdecode"),
+    ]
+}
+DEFAULT_ENCODING_PROFILE = ENCODING_PROFILES["fast"]
+
+
+def calculate_resize(original_width, original_height, target_short_edge=320):
+    if original_width < original_height:
+        new_width = target_short_edge
+        new_height = int(original_height * (target_short_edge / original_width))
+    else:
+        new_height = target_short_edge
+        new_width = int(original_width * (target_short_edge / original_height))
+
+    new_width = new_width + (new_width % 2)
+    new_height = new_height + (new_height % 2)
+
+    return new_width, new_height
+
+
+def get_encoding_profile(name: str) -> EncodingProfile:
+    if name not in ENCODING_PROFILES:
+        raise ValueError(
+            f"Unknown encoding profile '{name}'. Available: {', '.join(ENCODING_PROFILES)}"
+        )
+    return ENCODING_PROFILES[name]
+
+
+# Keyframe distance of proxies, short GOPs keep seeking cheap
+PROXY_GOP_DURATION = 1
+# Proxies are cut again into clips, so they are encoded at a higher quality
+PROXY_CRF = 16
+
+# (start frame, end frame inclusive, output path)
+Segment = Tuple[int, int, Path]
+
+
+def group_segments(segments: List[Segment], fps: float) -> List[List[Segment]]:
+    max_gap_frames = int(MAX_GAP_DURATION * fps)
+    groups = []
+    for segment in sorted(segments, key=lambda x: (x[0], x[1])):
+        if (
+            groups
+            and len(groups[-1]) < MAX_OUTPUTS_PER_PASS
+            and segment[0] - max(s[1] for s in groups[-1]) <= max_gap_frames
+        ):
+            groups[-1].append(segment)
+        else:
+            groups.append([segment])
+    return groups
+
+
+def _seek_args(
+    start_frame: int, end_frame: int, fps: float, frame_index: Optional[FrameIndex] = None
+) -> Tuple[list, int]:
+    """Input options to read frames start_frame..end_frame, and the first frame they decode.
+
+    With a frame index the input is opened at the exact timestamp of the keyframe preceding
+    start_frame, so frames are counted from a known frame instead of a rounded time.
+    """
+    if frame_index is None or end_frame >= len(frame_index):
+        # no timestamps: frame numbers are converted with the average fps
+        # half a frame of slack so rounding never drops the last frame of the pass
+        duration = (end_frame - start_frame + 1.5) / fps
+        return ["-ss", str(start_frame / fps), "-t", str(duration)], start_frame
+
+    seek_frame = frame_index.preceding_keyframe(start_frame)
+    duration = frame_index.seconds(end_frame) - frame_index.seconds(seek_frame) + 1.5 / fps
+    # -seek_timestamp makes -ss a stream timestamp, not an offset from the file start time
+    seek_args = ["-seek_timestamp", "1", "-ss", frame_index.pts_times[seek_frame]]
+    return seek_args + ["-t", str(duration)], seek_frame
+
+
+def _build_group_cmd(
+    video_path: Path,
+    group: List[Segment],
+    width: int,
+    height: int,
+    fps: float,
+    threads: Optional[int] = None,
+    profile: EncodingProfile = DEFAULT_ENCODING_PROFILE,
+    frame_index: Optional[FrameIndex] = None,
+) -> list:
+    group_end = max(end for _, end, _ in group)
+    seek_args, first_frame = _seek_args(group[0][0], group_end, fps, frame_index)
+
+    split_labels = "".join(f"[s{i}]" for i in range(len(group)))
+    filters = [f"[0:v]scale={width}:{height},split={len(group)}{split_labels}"]
+    for i, (start, end, _) in enumerate(group):
+        filters.append(
+            f"[s{i}]trim=start_frame={start - first_frame}:end_frame={end - first_frame + 1},"
+            f"setpts=PTS-STARTPTS[o{i}]"
+        )
+
+    thread_args = ["-threads", str(threads)] if threads else []
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *thread_args,
+        *seek_args,
+        "-i",
+        str(video_path),
+        # keep every decoded frame, so clips of variable frame rate sources keep their length
+        "-vsync",
+        "passthrough",
+        *(["-filter_complex_threads", str(threads)] if threads else []),
+        "-filter_complex",
+        ";".join(filters),
+    ]
+    for i, (_, _, output_clip) in enumerate(group):
+        cmd += [
+            "-map",
+            f"[o{i}]",
+            *profile.encoder_args(),
+            *thread_args,
+            "-an",
+            str(output_clip),
+        ]
+    return cmd
+
+
+def can_stream_copy(media_info: MediaInfo, width: int, height: int) -> bool:
+    """Clips of this source can be cut without re-encoding when they start on a keyframe.
+
+    B-frames are excluded because their decode order differs from presentation order,
+    so a packet-count cut would not end on the requested frame.
+    """
+    return (
+        (media_info.width, media_info.height) == (width, height)
+        and media_info.codec == "h264"
+        and media_info.pix_fmt == "yuv420p"
+        and not media_info.has_b_frames
+    )
+
+
+def _build_copy_cmd(video_path: Path, segment: Segment, seek_time: str) -> list:
+    start, end, output_clip = segment
+    return [
+        "ffmpeg",
+        "-y",
+        "-seek_timestamp",
+        "1",
+        "-ss",
+        seek_time,
+        "-i",
+        str(video_path),
+        "-frames:v",
+        str(end - start + 1),
+        "-c:v",
+        "copy",
+        "-an",
+        "-avoid_negative_ts",
+        "make_zero",
+        str(output_clip),
+    ]
+
+
+def _run_ffmpeg(cmd: list, segments: List[Segment]) -> None:
+    try:
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
+        logger.error(f"frame ranges: {[(start, end) for start, end, _ in segments]}")
+        raise
+
+
+def encode_segment(
+    video_path: Path,
+    start_frame: int,
+    end_frame: int,
+    output_clip: Path,
+    width: int,
+    height: int,
+    fps: float,
+    threads: Optional[int] = None,
+    profile: EncodingProfile = DEFAULT_ENCODING_PROFILE,
+    frame_index: Optional[FrameIndex] = None,
+) -> None:
+    """Transcode frames start_frame..end_frame into one clip, in its own decode pass."""
+    segment = (start_frame, end_frame, output_clip)
+    cmd = _build_group_cmd(video_path, [segment], width, height, fps, threads, profile, frame_index)
+    _run_ffmpeg(cmd, [segment])
+
+
+def extract_clips(
+    video_path: Path,
+    segments: List[Segment],
+    width: int,
+    height: int,
+    fps: float,
+    threads: Optional[int] = None,
+    frame_index: Optional[FrameIndex] = None,
+    on_written: Optional[Callable[[List[Segment]], None]] = None,
+    profile: EncodingProfile = DEFAULT_ENCODING_PROFILE,
+    stream_copy: bool = False,
+    backend: str = "ffmpeg",
+) -> None:
+    """Write every segment of one video, decoding and scaling each frame only once.
+
+    Segments are grouped in start order; every group is a single ffmpeg pass with
+    a multi-output filter graph. threads limits decoder, filter and encoder threads.
+    With a frame index of video_path every pass starts on the keyframe preceding its
+    first frame and frames are counted from there.
+    If stream_copy is set (needs frame_index), segments starting on a keyframe are cut
+    with -c copy instead.
+    on_written is called with the segments of every finished ffmpeg run.
+    Transcoded clips are encoded with profile.
+    backend is "ffmpeg" (one subprocess per pass) or "pyav" (in-process, needs PyAV).
+    """
+    if backend == "pyav":
+        from src.scripts.pyav_extraction import extract_clips_pyav
+
+        extract_clips_pyav(
+            video_path,
+            segments,
+            width,
+            height,
+            fps,
+            threads,
+            frame_index,
+            on_written=on_written,
+            profile=profile,
+            stream_copy=stream_copy,
+        )
+        return
+    if backend != "ffmpeg":
+        raise ValueError(f"Unknown extraction backend '{backend}'. Available: ffmpeg, pyav")
+
+    for _, _, output_clip in segments:
+        Path(output_clip).parent.mkdir(parents=True, exist_ok=True)
+
+    transcode_segments = []
+    for segment in segments:
+        if stream_copy and frame_index.is_keyframe(segment[0]):
+            cmd = _build_copy_cmd(Path(video_path), segment, frame_index.pts_times[segment[0]])
+            _run_ffmpeg(cmd, [segment])
+            if on_written is not None:
+                on_written([segment])
+        else:
+            transcode_segments.append(segment)
+    if stream_copy:
+        logger.debug(
+            f"Stream copied {len(segments) - len(transcode_segments)}/{len(segments)} clips "
+            f"of '{video_path}'"
+        )
+
+    for group in group_segments(transcode_segments, fps):
+        cmd = _build_group_cmd(
+            Path(video_path), group, width, height, fps, threads, profile, frame_index
+        )
+        _run_ffmpeg(cmd, group)
+        if on_written is not None:
+            on_written(group)
+
+
+def get_proxy_path(media_info: MediaInfo, width: int, height: int, cache_dir: str) -> Path:
+    return Path(cache_dir, "proxies", f"{media_info.fingerprint}_{width}x{height}.mp4")
+
+
+def get_proxy_gop(fps: float) -> int:
+    return max(1, round(PROXY_GOP_DURATION * fps))
+
+
+def get_proxy_keyframes(media_info: MediaInfo) -> List[int]:
+    """Keyframes of the proxy of a video, known without making it: the proxy has a fixed GOP,
+    no scene cut keyframes and no B-frames."""
+    return list(range(0, media_info.total_frames, get_proxy_gop(media_info.fps)))
+
+
+def make_proxy(
+    video_path: Path,
+    media_info: MediaInfo,
+    width: int,
+    height: int,
+    cache_dir: str,
+    threads: Optional[int] = None,
+) -> Path:
+    """Transcode the whole video once to the clip size with a short fixed GOP and no B-frames.
+
+    The proxy is cached by source fingerprint and size, so later runs with other labels
+    or sampling settings cut their clips from it without touching the source again.
+    """
+    proxy_path = get_proxy_path(media_info, width, height, cache_dir)
+    if proxy_path.exists():
+        return proxy_path
+    proxy_path.parent.mkdir(parents=True, exist_ok=True)
+
+    gop = get_proxy_gop(media_info.fps)
+    tmp_path = proxy_path.with_name(
+        f"{proxy_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+    )
+    thread_args = ["-threads", str(threads)] if threads else []
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *thread_args,
+        "-i",
+        str(video_path),
+        "-vf",
+        f"scale={width}:{height}",
+        "-vsync",
+        "passthrough",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "fast",
+        "-crf",
+        str(PROXY_CRF),
+        "-g",
+        str(gop),
+        "-keyint_min",
+        str(gop),
+        "-sc_threshold",
+        "0",
+        "-bf",
+        "0",
+        "-pix_fmt",
+        "yuv420p",
+        *thread_args,
+        "-an",
+        str(tmp_path),
+    ]
+    logger.info(f"Creating {width}x{height} proxy for '{video_path}'")
+    try:
+        _run_ffmpeg(cmd, [(0, media_info.total_frames - 1, proxy_path)])
+    except subprocess.CalledProcessError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, proxy_path)
+    return proxy_path
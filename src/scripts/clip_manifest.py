@@ -0,0 +1,50 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict
+
+from supervisely import logger
+
+
+def clip_key(**params) -> str:
+    """Hash of everything that determines the content of a clip."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ClipManifest:
+    """Clips already written for one source video: output path -> clip key and file size.
+
+    Every split video has its own manifest file, named by its split path and content,
+    and is handled by one worker at a time, so workers never write the same file even
+    when identical files are split from different datasets.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"Error loading clip manifest '{path}': {str(e)}")
+
+    def is_valid(self, output_clip: str, key: str) -> bool:
+        entry = self.entries.get(str(output_clip))
+        if entry is None or entry["key"] != key:
+            return False
+        return os.path.exists(output_clip) and os.path.getsize(output_clip) == entry["size"]
+
+    def record(self, output_clip: str, key: str) -> None:
+        self.entries[str(output_clip)] = {"key": key, "size": os.path.getsize(output_clip)}
+
+    def forget(self, output_clip: str) -> None:
+        self.entries.pop(str(output_clip), None)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,76 @@
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple
+
+from supervisely import logger
+
+
+@dataclass
+class PlannedClip:
+    orig_file: str
+    clip_file: str
+    tag: str
+    label: int
+    start: int
+    end: int
+    width: int
+    height: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+@dataclass
+class ClipPlan:
+    """Every clip of a run, computed before anything is encoded."""
+
+    seed: int
+    target_length: int
+    clips: List[PlannedClip] = field(default_factory=list)
+
+    def total_frames(self) -> int:
+        return sum(clip.length for clip in self.clips)
+
+
+def save_plan(plan: ClipPlan, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(asdict(plan), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_plan(path: str) -> Optional[ClipPlan]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        clips = [PlannedClip(**clip) for clip in data.pop("clips")]
+        return ClipPlan(clips=clips, **data)
+    except Exception as e:
+        logger.warning(f"Error loading clip plan '{path}': {str(e)}")
+        return None
+
+
+def _entry(clip: PlannedClip) -> Tuple:
+    # source videos are compared by name, split directories may move between runs
+    return (
+        os.path.basename(clip.orig_file),
+        clip.tag,
+        clip.start,
+        clip.end,
+        clip.width,
+        clip.height,
+    )
+
+
+def diff_plans(old: ClipPlan, new: ClipPlan) -> Tuple[List[PlannedClip], List[PlannedClip]]:
+    """Return the clips only in new (added) and only in old (removed)."""
+    old_entries = {_entry(clip) for clip in old.clips}
+    new_entries = {_entry(clip) for clip in new.clips}
+    added = [clip for clip in new.clips if _entry(clip) not in old_entries]
+    removed = [clip for clip in old.clips if _entry(clip) not in new_entries]
+    return added, removed
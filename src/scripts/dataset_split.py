@@ -0,0 +1,8 @@
+import hashlib
+
+
+def is_train_video(video_id: int, ratio: float, salt: str = "") -> bool:
+    """Stable split: the same video id always goes to the same split for a ratio and salt,
+    whatever other videos are processed in the run."""
+    digest = hashlib.sha1(f"{salt}:{video_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < ratio
@@ -1,40 +1,264 @@
-from supervisely import logger
-from supervisely.io.fs import mkdir
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from supervisely import batched, logger
+from supervisely.api.video.video_api import VideoInfo
+from supervisely.io.fs import clean_dir, mkdir
 from supervisely.project.download import _get_cache_dir, download_to_cache
-from supervisely.project.video_project import OpenMode, VideoProject
+from supervisely.project.video_project import OpenMode, VideoDataset, VideoProject
 
 import src.globals as g
+from src.scripts.dataset_split import is_train_video
+from src.scripts.dst_index import dst_index
+from src.scripts.item_index import get_dataset_paths, get_or_create_dataset_fs, get_project_fs
+from src.scripts.scratch_space import scratch
+from src.scripts.video_download import DownloadResult, DownloadTask, download_file, make_session
+from src.scripts.video_metadata import VideoMetaData
 
 
-def download_src_project():
-    logger.info("Downloading source project to cache")
-    with g.PROGRESS_BAR(
-        message="Downloading source project to cache", total=g.PROJECT_INFO.items_count
-    ) as pbar:
-        g.PROGRESS_BAR.show()
-        download_to_cache(g.API, g.PROJECT_ID, progress_cb=pbar.update)
-        g.PROGRESS_BAR.hide()
-    logger.info("Project downloaded to cache")
+def needs_video_file(video_metadata: VideoMetaData) -> bool:
+    """Train videos are clipped locally, test videos need their file only when they
+    can't be uploaded by link or hash."""
+    if is_train_video(video_metadata.video_id, g.SPLIT_RATIO, g.SPLIT_SALT):
+        return True
+    return video_metadata.get_upload_source() == "path"
+
+
+def refresh_dataset_items(
+    dataset_fs: VideoDataset, dataset_id: int, videos: List[VideoMetaData], pbar
+) -> List[Tuple[VideoDataset, VideoMetaData, dict]]:
+    """Fresh annotations for all videos. Returns the videos whose file still has to be
+    downloaded, they are added to the dataset once the file is there."""
+    video_ids = [video_metadata.video_id for video_metadata in videos]
+    ann_jsons = g.API.video.annotation.download_bulk(dataset_id, video_ids)
+    pending = []
+    for video_metadata, ann_json in zip(videos, ann_jsons):
+        name = video_metadata.name
+        need_file = needs_video_file(video_metadata)
+        has_file = os.path.exists(dataset_fs.generate_item_path(name))
+        if dataset_fs.item_exists(name) and (has_file or not need_file):
+            dataset_fs.set_ann_dict(name, ann_json)
+            pbar.update(1)
+            continue
+
+        if dataset_fs.item_exists(name):
+            dataset_fs.delete_item(name)
+        if need_file:
+            pending.append((dataset_fs, video_metadata, ann_json))
+            continue
+        dataset_fs.add_item_file(
+            name, None, ann=ann_json, item_info=video_metadata.source_video_info
+        )
+        pbar.update(1)
+    return pending
+
+
+def refresh_items(videos: List[VideoMetaData], pbar) -> Dict[int, tuple]:
+    """Refresh the annotations of all videos in the cached project.
+    Returns the videos whose file has to be downloaded, by video id."""
+    videos_by_dataset: Dict[int, List[VideoMetaData]] = {}
+    for video_metadata in videos:
+        videos_by_dataset.setdefault(video_metadata.dataset_id, []).append(video_metadata)
+
+    dataset_paths = get_dataset_paths(g.API.dataset.get_list(g.PROJECT_ID, recursive=True))
+    project_fs = get_project_fs(g.CACHED_PROJECT_DIR, g.PROJECT_META)
+    pending = {}
+    for dataset_id, dataset_videos in videos_by_dataset.items():
+        dataset_fs = get_or_create_dataset_fs(project_fs, dataset_paths[dataset_id])
+        for item in refresh_dataset_items(dataset_fs, dataset_id, dataset_videos, pbar):
+            pending[item[1].video_id] = item
+    return pending
+
+
+def add_downloaded_item(item: tuple, result: DownloadResult, pbar) -> None:
+    dataset_fs, video_metadata, ann_json = item
+    dataset_fs.add_item_file(
+        video_metadata.name,
+        result.task.path,
+        ann=ann_json,
+        item_info=video_metadata.source_video_info,
+    )
+    video_metadata.download_path = dataset_fs.generate_item_path(video_metadata.name)
+    scratch.add("download", video_metadata.download_path)
+    throughput = f"{result.throughput / 1024**2:.1f} MB/s"
+    logger.debug(
+        f"Video '{video_metadata.name}' downloaded at {throughput}",
+        extra={"bytes": result.bytes_received, "resumed_from": result.resumed_from},
+    )
+    pbar.set_postfix_str(f"{video_metadata.name}: {throughput}")
+    pbar.update(1)
+
+
+class Prefetcher:
+    """Downloads the new videos ahead of the caller, in rounds that fit the scratch budget.
+
+    A round yields videos in order, each once it is in the cached project, and takes no
+    more videos once the downloaded files are over SCRATCH_BUDGET_GB. Processing the round
+    releases its files, then the next round continues with the remaining videos. Without a
+    budget, or with budget_rounds off, all videos are one round.
+    """
+
+    def __init__(self, videos: List[VideoMetaData], lookahead: int, budget_rounds: bool = True):
+        self.videos = videos
+        self.remaining = deque(videos)
+        self.lookahead = max(1, lookahead)
+        self.budget_rounds = budget_rounds
+        self.rounds = 0
+        # videos whose file still has to be downloaded, by video id; None until refreshed
+        self.pending: Optional[Dict[int, tuple]] = None
+        self.downloads = 0
+
+    def next_round(self) -> Iterator[VideoMetaData]:
+        """Files are downloaded in the background, at most lookahead of them ahead of the
+        video the caller is working on. Downloaded files count as scratch space until the
+        video is clipped or uploaded."""
+        self.rounds += 1
+        total = len(self.videos)
+        with g.PROGRESS_BAR_2(message="Downloading new videos to cache", total=total) as pbar:
+            g.PROGRESS_BAR_2.show()
+            if self.pending is None:
+                logger.info(f"Downloading {total} new videos to cache, {self.lookahead} ahead")
+                self.pending = refresh_items(self.videos, pbar)
+                self.downloads = len(self.pending)
+            else:
+                pbar.update(total - len(self.pending))
+            yield from self._download(pbar)
+            g.PROGRESS_BAR_2.hide()
+        if self.remaining:
+            logger.info(
+                f"Scratch space over budget after round {self.rounds}, "
+                f"{len(self.remaining)} videos are left for the next round"
+            )
+        else:
+            logger.info(
+                f"Videos downloaded to cache: {self.downloads} files, "
+                f"{total - self.downloads} annotations only or already cached"
+            )
+
+    def _round_is_full(self) -> bool:
+        return self.budget_rounds and scratch.over_budget()
+
+    def _download(self, pbar) -> Iterator[VideoMetaData]:
+        workers = max(1, min(g.DOWNLOAD_WORKERS, self.lookahead))
+        chunk_size = g.DOWNLOAD_CHUNK_SIZE_MB * 1024**2
+
+        def finish(entry) -> VideoMetaData:
+            video_metadata, future = entry
+            if future is not None:
+                item = self.pending.pop(video_metadata.video_id)
+                add_downloaded_item(item, future.result(), pbar)
+            return video_metadata
+
+        with make_session(workers) as session, ThreadPoolExecutor(workers) as executor:
+            queue = deque()
+            taken = 0
+            # every round takes at least one video, so a budget smaller than one video
+            # still makes progress
+            while self.remaining and not (taken > 0 and self._round_is_full()):
+                video_metadata = self.remaining.popleft()
+                taken += 1
+                future = None
+                if video_metadata.video_id in self.pending:
+                    while queue and sum(f is not None for _, f in queue) >= self.lookahead:
+                        yield finish(queue.popleft())
+                    dataset_fs, _, _ = self.pending[video_metadata.video_id]
+                    task = DownloadTask(
+                        video_metadata.video_id,
+                        dataset_fs.generate_item_path(video_metadata.name),
+                        hash=video_metadata.source_video_info.hash,
+                    )
+                    future = executor.submit(download_file, session, task, chunk_size)
+                queue.append((video_metadata, future))
+                # videos already cached and finished downloads are handed over right away
+                while queue and (queue[0][1] is None or queue[0][1].done()):
+                    yield finish(queue.popleft())
+            while queue:
+                yield finish(queue.popleft())
+
+
+def is_item_fresh(dataset_fs: VideoDataset, video_info: VideoInfo) -> bool:
+    if not dataset_fs.item_exists(video_info.name):
+        return False
+    try:
+        item_info = dataset_fs.get_item_info(video_info.name)
+    except Exception as e:
+        logger.debug(f"Error reading item info of '{video_info.name}': {str(e)}")
+        return False
+    return item_info.id == video_info.id and item_info.updated_at == video_info.updated_at
+
+
+def sync_dataset_mirror(dataset_fs: VideoDataset, dataset_id: int, pbar) -> int:
+    """Bring one dataset of the annotation-only mirror up to date with the destination index.
+    Returns the number of refreshed items."""
+    server_items = {info.name: info for info in dst_index.get_dataset_items(dataset_id)}
+    for item_name in [name for name, _, _ in dataset_fs.items()]:
+        if item_name not in server_items:
+            dataset_fs.delete_item(item_name)
+
+    stale = [info for info in server_items.values() if not is_item_fresh(dataset_fs, info)]
+    pbar.update(len(server_items) - len(stale))
+    for batch in batched(stale, 50):
+        ann_jsons = g.API.video.annotation.download_bulk(dataset_id, [info.id for info in batch])
+        for video_info, ann_json in zip(batch, ann_jsons):
+            if dataset_fs.item_exists(video_info.name):
+                dataset_fs.delete_item(video_info.name)
+            dataset_fs.add_item_file(video_info.name, None, ann=ann_json, item_info=video_info)
+        pbar.update(len(batch))
+    return len(stale)
+
+
+def remove_mirrored_files(dataset_fs: VideoDataset) -> bool:
+    """Make a dataset mirrored with video files by an earlier run annotation-only.
+
+    A dataset with files lists only the items that have one, so the annotation-only items
+    added next to them would look missing, and be downloaded again, on every run.
+    """
+    if not os.path.isdir(dataset_fs.item_dir) or not os.listdir(dataset_fs.item_dir):
+        return False
+    clean_dir(dataset_fs.item_dir)
+    return True
+
+
+def sync_dst_mirror(pbar) -> None:
+    """Keep only item infos and annotations of the destination project locally.
+    Items unchanged since the last run are not downloaded again."""
+    converted = [
+        dataset_id
+        for dataset_id in dst_index.datasets
+        if remove_mirrored_files(dst_index.get_dataset_fs(dataset_id))
+    ]
+    if converted:
+        logger.info(f"Removed mirrored video files of {len(converted)} datasets")
+        # reopened, so the annotation-only items are listed
+        dst_index.project_fs = None
+    refreshed = 0
+    for dataset_id in dst_index.datasets:
+        dataset_fs = dst_index.get_dataset_fs(dataset_id)
+        refreshed += sync_dataset_mirror(dataset_fs, dataset_id, pbar)
+    logger.debug(f"Destination mirror synced, {refreshed} items refreshed")
 
 
 def download_dst_project():
-    target_datasets = g.API.dataset.get_list(g.DST_PROJECT_ID, recursive=True)
-    target_items = sum(ds.items_count for ds in target_datasets)
+    """Bring the local mirror of the destination project up to date with the destination
+    index built when the project was checked."""
+    target_items = len(dst_index.items)
     logger.debug(
         "Downloading destination project",
         extra={"project_id": g.DST_PROJECT_ID, "items": target_items},
     )
     with g.PROGRESS_BAR(message="Downloading destination project", total=target_items) as pbar:
         g.PROGRESS_BAR.show()
-        if len(target_datasets) > 0:
+        if not g.MIRROR_DST_VIDEO_FILES:
+            sync_dst_mirror(pbar)
+        elif len(dst_index.datasets) > 0:
             download_to_cache(g.API, g.DST_PROJECT_ID, progress_cb=pbar.update)
+            # reopened with the downloaded items
+            dst_index.project_fs = None
         else:
             mkdir(g.DST_PROJECT_PATH, True)
             video_project = VideoProject(g.DST_PROJECT_PATH, OpenMode.CREATE)
             video_project.set_meta(g.DST_PROJECT_META)
+            dst_index.project_fs = video_project
         g.PROGRESS_BAR.hide()
-
-
-def download_project():
-    download_src_project()
-    return g.CACHED_PROJECT_DIR
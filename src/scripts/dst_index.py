@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from supervisely import logger
+from supervisely.api.dataset_api import DatasetInfo
+from supervisely.api.video.video_api import VideoInfo
+from supervisely.project.video_project import VideoDataset, VideoProject
+
+import src.globals as g
+from src.scripts.item_index import get_dataset_paths, get_or_create_dataset_fs, get_project_fs
+
+
+@dataclass
+class DstItem:
+    dataset_id: int
+    name: str
+    info: VideoInfo
+
+
+class DstIndex:
+    """Videos of the destination project by id, listed once per run and updated by every
+    stage that uploads, with the local mirror of the project opened once."""
+
+    def __init__(self):
+        self.datasets: Dict[int, DatasetInfo] = {}
+        self.items: Dict[int, DstItem] = {}
+        self._project_fs: Optional[VideoProject] = None
+
+    def build(
+        self, datasets: List[DatasetInfo], progress_cb: Optional[Callable[[int], None]] = None
+    ) -> None:
+        self.datasets = {}
+        self.items = {}
+        for dataset in datasets:
+            self.add_dataset(dataset)
+            for video_info in g.API.video.get_list(dataset.id):
+                self.add(video_info)
+            if progress_cb is not None:
+                progress_cb(1)
+        logger.debug(
+            "Destination index built",
+            extra={"datasets": len(self.datasets), "items": len(self.items)},
+        )
+
+    def add_dataset(self, dataset: DatasetInfo) -> None:
+        self.datasets[dataset.id] = dataset
+
+    def add(self, video_info: VideoInfo) -> None:
+        self.items[video_info.id] = DstItem(video_info.dataset_id, video_info.name, video_info)
+
+    def get(self, video_id) -> Optional[DstItem]:
+        return self.items.get(int(video_id))
+
+    def get_dataset_items(self, dataset_id: int) -> List[VideoInfo]:
+        return [item.info for item in self.items.values() if item.dataset_id == dataset_id]
+
+    @property
+    def project_fs(self) -> VideoProject:
+        if self._project_fs is None:
+            self._project_fs = get_project_fs(g.DST_PROJECT_PATH, g.DST_PROJECT_META)
+        return self._project_fs
+
+    @project_fs.setter
+    def project_fs(self, project_fs: Optional[VideoProject]) -> None:
+        self._project_fs = project_fs
+
+    def get_dataset_fs(self, dataset_id: int) -> VideoDataset:
+        """Dataset of the local mirror, created if the mirror doesn't have it yet."""
+        ds_path = get_dataset_paths(list(self.datasets.values()))[dataset_id]
+        return get_or_create_dataset_fs(self.project_fs, ds_path)
+
+
+dst_index = DstIndex()
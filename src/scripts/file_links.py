@@ -0,0 +1,49 @@
+import fcntl
+import os
+import shutil
+from typing import Sequence
+
+from supervisely import logger
+
+# ioctl of Linux filesystems with copy-on-write clones (btrfs, xfs)
+FICLONE = 0x40049409
+
+# in order of preference; "copy" materializes the file
+LINK_METHODS = ("hardlink", "reflink", "symlink", "copy")
+
+
+def _reflink(src: str, dst: str) -> None:
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def _link(method: str, src: str, dst: str) -> None:
+    if method == "hardlink":
+        os.link(src, dst)
+    elif method == "reflink":
+        _reflink(src, dst)
+    elif method == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    elif method == "copy":
+        shutil.copy(src, dst)
+    else:
+        raise ValueError(f"Unknown link method '{method}'")
+
+
+def link_or_copy(src: str, dst: str, methods: Sequence[str] = LINK_METHODS) -> str:
+    """Make dst point to the content of src with the first method the filesystem allows.
+
+    Returns the method used.
+    """
+    for method in methods:
+        try:
+            _link(method, src, dst)
+            return method
+        except OSError as e:
+            logger.debug(f"Could not {method} '{src}' to '{dst}': {str(e)}")
+    raise OSError(f"Could not link or copy '{src}' to '{dst}' with any of {list(methods)}")
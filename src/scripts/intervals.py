@@ -0,0 +1,115 @@
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _expand_counts(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """For per-row repeat counts return (row index, position within row) of every output."""
+    rows = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, offsets
+
+
+def segment_ranges(starts: np.ndarray, ends: np.ndarray, max_length: int) -> np.ndarray:
+    """Split every inclusive range into the fewest near-equal parts of at most max_length.
+
+    Longer parts come first, like the original split_range. Returns an (N, 2) array.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    lengths = ends - starts + 1
+    counts = np.maximum(1, -(-lengths // max(1, max_length)))
+    base = lengths // counts
+    extra = lengths % counts
+
+    rows, k = _expand_counts(counts)
+    seg_starts = starts[rows] + k * base[rows] + np.minimum(k, extra[rows])
+    seg_ends = seg_starts + base[rows] + (k < extra[rows]) - 1
+    return np.stack([seg_starts, seg_ends], axis=1)
+
+
+class IntervalSet:
+    """Sorted, disjoint, non-adjacent inclusive integer ranges stored as two arrays."""
+
+    def __init__(self, starts: Optional[np.ndarray] = None, ends: Optional[np.ndarray] = None):
+        self.starts = np.asarray([] if starts is None else starts, dtype=np.int64)
+        self.ends = np.asarray([] if ends is None else ends, dtype=np.int64)
+
+    @staticmethod
+    def from_ranges(ranges: Iterable, within: Optional[Tuple[int, int]] = None) -> "IntervalSet":
+        """Merge [start, end] ranges; touching ranges are merged too.
+
+        If within=(lo, hi) is given, ranges not fully inside it are dropped first.
+        """
+        arr = np.asarray(list(ranges), dtype=np.int64).reshape(-1, 2)
+        if within is not None:
+            lo, hi = within
+            inside = (arr[:, 0] >= lo) & (arr[:, 0] <= hi) & (arr[:, 1] >= lo) & (arr[:, 1] <= hi)
+            arr = arr[inside]
+        return IntervalSet._merge(arr[:, 0], arr[:, 1])
+
+    @staticmethod
+    def _merge(starts: np.ndarray, ends: np.ndarray) -> "IntervalSet":
+        if len(starts) == 0:
+            return IntervalSet()
+        order = np.argsort(starts, kind="stable")
+        starts = starts[order]
+        ends = ends[order]
+        running_end = np.maximum.accumulate(ends)
+        is_first = np.empty(len(starts), dtype=bool)
+        is_first[0] = True
+        is_first[1:] = starts[1:] > running_end[:-1] + 1
+        first_idx = np.flatnonzero(is_first)
+        return IntervalSet(starts[first_idx], np.maximum.reduceat(ends, first_idx))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, IntervalSet)
+            and np.array_equal(self.starts, other.starts)
+            and np.array_equal(self.ends, other.ends)
+        )
+
+    def __repr__(self) -> str:
+        return f"IntervalSet({self.to_list()})"
+
+    def to_list(self) -> List[List[int]]:
+        return np.stack([self.starts, self.ends], axis=1).tolist()
+
+    def total_length(self) -> int:
+        return int((self.ends - self.starts + 1).sum())
+
+    def union(self, other: "IntervalSet") -> "IntervalSet":
+        return IntervalSet._merge(
+            np.concatenate([self.starts, other.starts]), np.concatenate([self.ends, other.ends])
+        )
+
+    def intersection(self, other: "IntervalSet") -> "IntervalSet":
+        # for every own range, the block of other's ranges overlapping it
+        first = np.searchsorted(other.ends, self.starts, side="left")
+        last = np.searchsorted(other.starts, self.ends, side="right")
+        counts = np.maximum(last - first, 0)
+        rows, k = _expand_counts(counts)
+        cols = first[rows] + k
+        starts = np.maximum(self.starts[rows], other.starts[cols])
+        ends = np.minimum(self.ends[rows], other.ends[cols])
+        return IntervalSet(starts, ends)
+
+    def clip(self, lo: int, hi: int) -> "IntervalSet":
+        return self.intersection(IntervalSet([lo], [hi]))
+
+    def complement(self, lo: int, hi: int) -> "IntervalSet":
+        """Ranges of [lo, hi] not covered by the set."""
+        clipped = self.clip(lo, hi)
+        gap_starts = np.concatenate([[lo], clipped.ends + 1])
+        gap_ends = np.concatenate([clipped.starts - 1, [hi]])
+        keep = gap_starts <= gap_ends
+        return IntervalSet(gap_starts[keep], gap_ends[keep])
+
+    def segment(self, max_length: int) -> np.ndarray:
+        return segment_ranges(self.starts, self.ends, max_length)
@@ -0,0 +1,154 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from supervisely import logger
+from supervisely.api.dataset_api import DatasetInfo
+from supervisely.io.fs import mkdir
+from supervisely.project.project import OpenMode
+from supervisely.project.video_project import VideoDataset, VideoProject
+
+from src.scripts.video_metadata import VideoMetaData
+
+# (item name, video path, annotation path)
+ItemPaths = Tuple[str, str, str]
+
+# Subdirectories of a dataset in a downloaded video project
+ITEM_DIRS = ("video", "ann", "video_info")
+NESTED_DATASETS_DIR = "datasets"
+
+
+def get_dataset_dirs(project_dir: str) -> Dict[str, List[str]]:
+    """Dataset name -> directories of datasets with that name, nested ones included.
+
+    Only directories are visited, item directories are not listed.
+    """
+    dataset_dirs = {}
+    parents = [project_dir]
+    while parents:
+        parent = parents.pop()
+        if not os.path.isdir(parent):
+            continue
+        for entry in os.scandir(parent):
+            if not entry.is_dir() or entry.name in ITEM_DIRS:
+                continue
+            if os.path.isdir(os.path.join(entry.path, "video")):
+                dataset_dirs.setdefault(entry.name, []).append(entry.path)
+                parents.append(os.path.join(entry.path, NESTED_DATASETS_DIR))
+    return dataset_dirs
+
+
+def get_dataset_paths(datasets: List[DatasetInfo]) -> Dict[int, str]:
+    """Dataset id -> path of the dataset inside a downloaded project."""
+    datasets = {ds.id: ds for ds in datasets}
+    paths = {}
+    for dataset_id, dataset in datasets.items():
+        names = [dataset.name]
+        while dataset.parent_id in datasets:
+            dataset = datasets[dataset.parent_id]
+            names.append(dataset.name)
+        paths[dataset_id] = f"/{VideoDataset.datasets_dir_name}/".join(reversed(names))
+    return paths
+
+
+def get_project_fs(project_dir: str, project_meta) -> VideoProject:
+    """Open a downloaded project, or create an empty one if there is none yet.
+
+    Only a missing or empty project is recreated; other read errors are raised, so a
+    project with a broken item doesn't lose everything else that is cached.
+    """
+    try:
+        project_fs = VideoProject(project_dir, OpenMode.READ)
+    except (RuntimeError, FileNotFoundError) as e:
+        if os.path.isdir(project_dir) and "Project is empty" not in str(e):
+            raise
+        logger.debug(f"Creating local project '{project_dir}': {str(e)}")
+        mkdir(project_dir, True)
+        project_fs = VideoProject(project_dir, OpenMode.CREATE)
+    project_fs.set_meta(project_meta)
+    return project_fs
+
+
+def get_or_create_dataset_fs(project_fs: VideoProject, ds_path: str) -> VideoDataset:
+    for dataset in project_fs.datasets:
+        dataset: VideoDataset
+        if dataset.path == ds_path:
+            return dataset
+    return project_fs.create_dataset(os.path.basename(ds_path), ds_path)
+
+
+def _read_item_id(dataset_dir: str, name: str) -> Optional[int]:
+    info_path = os.path.join(dataset_dir, "video_info", f"{name}.json")
+    if not os.path.exists(info_path):
+        return None
+    try:
+        with open(info_path, "r") as f:
+            return json.load(f).get("id")
+    except Exception as e:
+        logger.warning(f"Error reading item info '{info_path}': {str(e)}")
+        return None
+
+
+class ItemIndex:
+    """Persisted video id -> paths index of a downloaded project, updated incrementally."""
+
+    def __init__(self, project_dir: str, index_path: str):
+        self.project_dir = project_dir
+        self.index_path = index_path
+        self.items: Dict[str, ItemPaths] = {}
+        self._dataset_dirs: Optional[Dict[str, List[str]]] = None
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r") as f:
+                    self.items = {k: tuple(v) for k, v in json.load(f).items()}
+            except Exception as e:
+                logger.warning(f"Error loading item index '{index_path}': {str(e)}")
+
+    @property
+    def dataset_dirs(self) -> Dict[str, List[str]]:
+        if self._dataset_dirs is None:
+            self._dataset_dirs = get_dataset_dirs(self.project_dir)
+        return self._dataset_dirs
+
+    def _find(self, video_metadata: VideoMetaData) -> Optional[ItemPaths]:
+        name = video_metadata.name
+        for dataset_dir in self.dataset_dirs.get(video_metadata.dataset, []):
+            # test videos uploaded by link or hash are cached without the file
+            ann_path = os.path.join(dataset_dir, "ann", f"{name}.json")
+            if not os.path.exists(ann_path):
+                continue
+            # datasets with the same name are told apart by the id in the item info
+            item_id = _read_item_id(dataset_dir, name)
+            if item_id is not None and item_id != video_metadata.video_id:
+                continue
+            return name, os.path.join(dataset_dir, "video", name), ann_path
+        return None
+
+    def get(self, video_metadata: VideoMetaData) -> Optional[ItemPaths]:
+        key = str(video_metadata.video_id)
+        paths = self.items.get(key)
+        if paths is not None and os.path.exists(paths[2]):
+            return paths
+        paths = self._find(video_metadata)
+        if paths is None:
+            self.items.pop(key, None)
+        else:
+            self.items[key] = paths
+        return paths
+
+    def find(self, video_metadata: VideoMetaData) -> Optional[ItemPaths]:
+        """Like get(), with a warning for videos missing from the cached project."""
+        paths = self.get(video_metadata)
+        if paths is None:
+            logger.warning(
+                f"Video '{video_metadata.name}' (id: {video_metadata.video_id}) "
+                "not found in the cached project"
+            )
+        return paths
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.items, f)
+        os.replace(tmp_path, self.index_path)
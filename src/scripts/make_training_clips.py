@@ -1,398 +1,631 @@
+import csv
 import json
 import math
 import os
 import random
-import subprocess
+import re
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass, fields
 from pathlib import Path
+from typing import Callable, Dict, List, Optional
 
-import pandas as pd
+import numpy as np
 from supervisely import logger
-from supervisely.io.fs import clean_dir
+from supervisely.io.fs import clean_dir, silent_remove
 from supervisely.io.json import dump_json_file
 from supervisely.video_annotation.video_annotation import VideoAnnotation
 
 import src.globals as g
+from src.scripts.clip_extraction import (
+    calculate_resize,
+    can_stream_copy,
+    extract_clips,
+    get_encoding_profile,
+    get_proxy_keyframes,
+    get_proxy_path,
+    make_proxy,
+)
+from src.scripts.clip_manifest import ClipManifest, clip_key
+from src.scripts.clip_plan import ClipPlan, PlannedClip, diff_plans, load_plan, save_plan
+from src.scripts.intervals import IntervalSet, segment_ranges
+from src.scripts.media_probe import FrameIndex, MediaInfo, probe_frame_index, probe_video
+from src.scripts.scratch_space import ScratchSpace, scratch
 from src.scripts.video_metadata import VideoMetaData
 
+LABELS = {"Self-Grooming": 1, "Head/Body TWITCH": 2}
 
-def get_video_dimensions(video_path):
-    cmd = [
-        "ffprobe",
-        "-v",
-        "error",
-        "-select_streams",
-        "v:0",
-        "-show_entries",
-        "stream=width,height",
-        "-of",
-        "csv=p=0",
-        str(video_path),
-    ]
-    output = subprocess.check_output(cmd).decode("utf-8").strip().split(",")
-    return int(output[0]), int(output[1])
-
-
-def get_fps(video_path):
-    cmd = [
-        "ffprobe",
-        "-v",
-        "error",
-        "-select_streams",
-        "v:0",
-        "-show_entries",
-        "stream=r_frame_rate",
-        "-of",
-        "csv=p=0",
-        str(video_path),
-    ]
-    output = subprocess.check_output(cmd).decode("utf-8").strip()
-    if "/" in output:
-        numerator, denominator = output.split("/")
-        return int(numerator) / int(denominator)
-    else:
-        return float(output)
-
-
-def get_total_frames(video_path):
-    cmd = [
-        "ffprobe",
-        "-v",
-        "error",
-        "-select_streams",
-        "v:0",
-        "-show_entries",
-        "stream=nb_frames",
-        "-of",
-        "csv=p=0",
-        str(video_path),
-    ]
-    output = subprocess.check_output(cmd).decode("utf-8").strip()
-
-    if output and output != "N/A":
-        return int(output)
-    else:
-        logger.warning("Frame count not found in metadata. Counting frames manually.")
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-select_streams",
-            "v:0",
-            "-show_entries",
-            "stream=duration",
-            "-of",
-            "csv=p=0",
-            str(video_path),
-        ]
-        duration = float(subprocess.check_output(cmd).decode("utf-8").strip())
-        fps = get_fps(video_path)
-        return int(duration * fps)
-
-
-def calculate_resize(original_width, original_height, target_short_edge=320):
-    if original_width < original_height:
-        new_width = target_short_edge
-        new_height = int(original_height * (target_short_edge / original_width))
-    else:
-        new_height = target_short_edge
-        new_width = int(original_width * (target_short_edge / original_height))
-
-    new_width = new_width + (new_width % 2)
-    new_height = new_height + (new_height % 2)
-
-    return new_width, new_height
-
-
-def extract_clip(video_path, start, end, width, height, fps, output_clip):
-    start_time = start / fps
-    duration = (end - start + 1) / fps
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-ss",
-        str(start_time),
-        "-i",
-        str(video_path),
-        "-t",
-        str(duration),
-        "-vf",
-        f"scale={width}:{height}",
-        "-c:v",
-        "libx264",
-        "-preset",
-        "fast",
-        "-crf",
-        "20",
-        "-pix_fmt",
-        "yuv420p",
-        "-force_key_frames",
-        "expr:gte(t,0)",
-        "-an",
-        str(output_clip),
-    ]
 
-    try:
-        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
-        logger.error(f"start frame: {start}, end frame: {end}")
-        raise
+def normalize_label(tag: str) -> str:
+    return tag.lower()
 
 
-def get_frame_ranges(ann_file: dict, target_tag: str):
-    frame_ranges = []
+def get_frame_ranges_by_label(ann_file: dict, labels: list) -> Dict[str, list]:
+    normalized_labels = [normalize_label(label) for label in labels]
+    frame_ranges = {label: [] for label in normalized_labels}
     for video_tag in ann_file["tags"]:
-        if video_tag["name"].lower().startswith(target_tag.lower()):
-            frame_ranges.append(video_tag["frameRange"])
+        tag_name = normalize_label(video_tag["name"])
+        for label in normalized_labels:
+            if tag_name.startswith(label):
+                frame_ranges[label].append(list(video_tag["frameRange"]))
     return frame_ranges
 
 
-def merge_overlapping_ranges(ranges: list) -> list:
-    ranges = sorted(ranges, key=lambda x: x[0])
-    merged = []
-    for rng in ranges:
-        if not merged or rng[0] > merged[-1][1] + 1:
-            merged.append(rng)
-        else:
-            merged[-1][1] = max(merged[-1][1], rng[1])
-    ranges = merged
-    return ranges
+def filter_ranges_outside_video(ranges: list, total_frames: int) -> IntervalSet:
+    return IntervalSet.from_ranges(ranges, within=(0, total_frames - 1))
 
 
-def filter_ranges_outside_video(ranges: list, total_frames: int) -> list:
-    return [
-        [start, end]
-        for start, end in ranges
-        if 0 <= start < total_frames and 0 <= end < total_frames
-    ]
+def split_ranges(
+    ranges: IntervalSet, fps: float, total_frames: int, max_clip_duration: float = 5
+) -> list:
+    starts = ranges.starts.copy()
+    ends = ranges.ends.copy()
 
+    # single-frame tags are widened to a one second clip around the frame
+    single = starts == ends
+    starts[single] = np.maximum(0, starts[single] - int(fps // 2))
+    ends[single] = np.minimum(total_frames - 1, (starts[single] + fps - 1).astype(np.int64))
 
-def split_range(
-    start: int, end: int, fps: float, total_frames: int, max_clip_duration: float = 5
-) -> list:
-    segments = []
-    clip_frames = end - start + 1
-
-    if clip_frames == 1:
-        half = int(fps // 2)
-        start = max(0, start - half)
-        end = min(total_frames - 1, int(start + fps - 1))
-        clip_frames = end - start + 1
-
-    ten_sec_frames = int(max_clip_duration * fps)
-    if clip_frames > ten_sec_frames:
-        seg_count = math.ceil(clip_frames / ten_sec_frames)
-        base_seg_length = clip_frames // seg_count
-        extra = clip_frames % seg_count
-        current_start = start
-        for i in range(seg_count):
-            current_seg_length = base_seg_length + (1 if i < extra else 0)
-            current_end = current_start + current_seg_length - 1
-            segments.append((current_start, current_end))
-            current_start = current_end + 1
-    else:
-        segments.append((start, end))
-
-    return segments
-
-
-def make_pos_clips_for_tag(
-    video_file: str,
-    ann_file: str,
-    output_dir: str,
-    target_short_edge: int,
-    tag: str,
-    label: int,
-):
-    video_path = Path(video_file)
-    video_name = video_path.stem
-    out_dir = Path(output_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+    return [
+        tuple(seg) for seg in segment_ranges(starts, ends, int(max_clip_duration * fps)).tolist()
+    ]
 
-    tag_name = tag.replace("/", "-").replace(" ", "_")
-    tag_dir = out_dir / tag_name
-    tag_dir.mkdir(parents=True, exist_ok=True)
 
-    tag_video_dir = tag_dir / "video"
-    tag_video_dir.mkdir(parents=True, exist_ok=True)
+@dataclass
+class AnnotationIndex:
+    video_path: Path
+    media_info: MediaInfo
+    # normalized label -> merged frame ranges inside the video
+    ranges: Dict[str, IntervalSet]
+    # merged frame ranges covered by positive clips of any label
+    occupied: IntervalSet
+
+
+@dataclass
+class ClipRecord:
+    orig_file: str
+    clip_file: str
+    start: int
+    end: int
+    label: int
+
+    @property
+    def length(self) -> int:
+        # +1 because end frame is inclusive
+        return self.end - self.start + 1
+
+
+CLIP_RECORD_FIELDS = [field.name for field in fields(ClipRecord)]
+
+
+def write_clip_records(records: List[ClipRecord], csv_path: str) -> None:
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CLIP_RECORD_FIELDS)
+        writer.writerows(astuple(record) for record in records)
+
+
+def write_positive_lengths(records: List[ClipRecord], csv_path: str) -> List[int]:
+    """Write total, count and mean clip length per source video, return the totals."""
+    lengths = defaultdict(list)
+    for record in records:
+        lengths[record.orig_file].append(record.length)
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["orig_file", "total_frames", "clip_count", "avg_length_per_clip"])
+        for orig_file in sorted(lengths):
+            video_lengths = lengths[orig_file]
+            total = sum(video_lengths)
+            writer.writerow([orig_file, total, len(video_lengths), total / len(video_lengths)])
+    return [sum(video_lengths) for video_lengths in lengths.values()]
+
+
+def attach_clips_to_videos(
+    records: List[ClipRecord], videos: List[VideoMetaData]
+) -> List[VideoMetaData]:
+    # source videos are matched by file name
+    videos_by_name = {
+        os.path.basename(video.path) if video.path else video.name: video for video in videos
+    }
+    clips = []
+    for record in records:
+        source_video = videos_by_name.get(os.path.basename(record.orig_file))
+        if source_video is None:
+            continue
+        if 0 <= record.label < len(g.CLIP_LABELS):
+            label = g.CLIP_LABELS[record.label]
+        else:
+            label = f"label_{record.label}"
+
+        clip = VideoMetaData.create_clip(
+            source_video=source_video,
+            name=os.path.basename(record.clip_file),
+            start_frame=record.start,
+            end_frame=record.end,
+            label=label,
+        )
+        clip.path = record.clip_file
+        source_video.clips.append(clip)
+        clips.append(clip)
+    return clips
 
-    tag_ann_dir = tag_dir / "ann"
-    tag_ann_dir.mkdir(parents=True, exist_ok=True)
 
-    fps = get_fps(video_path)
-    total_frames = get_total_frames(video_path)
+def build_annotation_index(video_path: Path, ann_path: Path, labels: list) -> AnnotationIndex:
+    media_info = probe_video(video_path, g.MEDIA_CACHE_DIR)
+    total_frames = media_info.total_frames
 
-    with open(ann_file, "r") as f:
+    with open(ann_path, "r") as f:
         ann = json.load(f)
 
-    ranges = get_frame_ranges(ann, target_tag=tag)
-    ranges = filter_ranges_outside_video(ranges, total_frames)
-    ranges = merge_overlapping_ranges(ranges)
+    ranges = {}
+    occupied = IntervalSet()
+    for label, label_ranges in get_frame_ranges_by_label(ann, labels).items():
+        ranges[label] = filter_ranges_outside_video(label_ranges, total_frames)
+        segments = split_ranges(ranges[label], media_info.fps, total_frames)
+        occupied = occupied.union(IntervalSet.from_ranges(segments))
+
+    return AnnotationIndex(
+        video_path=Path(video_path),
+        media_info=media_info,
+        ranges=ranges,
+        occupied=occupied,
+    )
 
-    info = []
-    clip_counter = 1
-    for frame_range in ranges:
-        start, end = frame_range
-        segments = split_range(start, end, fps, total_frames)
 
-        for seg in segments:
-            seg_start, seg_end = seg
-            clip_name = f"{video_name}_clip_{clip_counter:03d}.mp4"
-
-            output_clip = tag_video_dir / clip_name
-            output_clip.parent.mkdir(parents=True, exist_ok=True)
-            width, height = get_video_dimensions(video_path)
-            new_width, new_height = calculate_resize(
-                width, height, target_short_edge=target_short_edge
+def build_annotation_indices(paths: List[Path], labels: list) -> List[AnnotationIndex]:
+    indices = []
+    for video_file in paths:
+        ann_file = video_file.parent.parent / f"ann/{video_file.name}.json"
+        if not ann_file.exists():
+            logger.warn(f"Annotation file not found: {ann_file}")
+            continue
+        indices.append(build_annotation_index(video_file, ann_file, labels))
+    return indices
+
+
+@dataclass
+class ClipSource:
+    """File the clips of one video are cut from, with its frame index."""
+
+    path: Path
+    frame_index: FrameIndex
+    stream_copy: bool
+
+
+def get_clip_source(
+    index: AnnotationIndex, width: int, height: int, threads: int = None
+) -> ClipSource:
+    """Return the file clips are cut from, its frame index and whether clips can be copied."""
+    video_path = index.video_path
+    media_info = index.media_info
+    if g.USE_PROXY:
+        proxy_path = make_proxy(video_path, media_info, width, height, g.MEDIA_CACHE_DIR, threads)
+        scratch.add("proxy", proxy_path)
+        proxy_info = probe_video(proxy_path, g.MEDIA_CACHE_DIR)
+        if proxy_info.total_frames == media_info.total_frames:
+            video_path = proxy_path
+            media_info = proxy_info
+        else:
+            logger.warning(
+                f"Proxy of '{video_path}' has {proxy_info.total_frames} frames instead of "
+                f"{media_info.total_frames}, clips will be cut from the source"
             )
-            extract_clip(video_path, seg_start, seg_end, new_width, new_height, fps, output_clip)
-
-            ann_file = tag_ann_dir / clip_name.replace(".mp4", ".mp4.json")
-            ann = VideoAnnotation((new_width, new_height), seg_end - seg_start + 1)
-            dump_json_file(ann.to_json(), ann_file)
 
-            # orig_file, clip_file, start, end, label(1,2)
-            info.append([str(video_path), str(output_clip), seg_start, seg_end, label])
-            clip_counter += 1
+    frame_index = probe_frame_index(video_path, g.MEDIA_CACHE_DIR)
+    stream_copy = g.STREAM_COPY_CLIPS and can_stream_copy(media_info, width, height)
+    return ClipSource(video_path, frame_index, stream_copy)
+
+
+def get_clip_keys(index: AnnotationIndex, clip_segments: list, width: int, height: int) -> dict:
+    """Manifest key of every planned clip, by output path.
+
+    Stream copied and transcoded clips differ, so the key includes whether the clip is
+    copied, and the backend that writes it.
+    """
+    profile = get_encoding_profile(g.ENCODING_PROFILE)
+    copy_keyframes = set()
+    if g.STREAM_COPY_CLIPS and clip_segments:
+        copy_keyframes = set(get_source_keyframes(index, width, height) or [])
+    return {
+        str(output_clip): clip_key(
+            source=index.media_info.fingerprint,
+            start=start,
+            end=end,
+            width=width,
+            height=height,
+            encoder=profile.encoder_args(),
+            proxy=g.USE_PROXY,
+            seek="frame_index",
+            stream_copy=start in copy_keyframes,
+            backend=g.EXTRACTION_BACKEND,
+        )
+        for start, end, output_clip in clip_segments
+    }
+
+
+def get_manifest(index: AnnotationIndex) -> ClipManifest:
+    # split names are unique per dataset, the fingerprint invalidates replaced files
+    name = f"{index.video_path.stem}_{index.media_info.fingerprint}.json"
+    return ClipManifest(os.path.join(g.CLIP_MANIFEST_DIR, name))
+
+
+def write_clips(
+    index: AnnotationIndex,
+    tag_video_dir: Path,
+    clip_segments: list,
+    width: int,
+    height: int,
+    threads: int = None,
+    clip_source: Optional[ClipSource] = None,
+) -> None:
+    """Extract the clips of one video and tag that its manifest does not have yet.
+
+    Clips of this video in tag_video_dir that are not planned any more are removed.
+    """
+    profile = get_encoding_profile(g.ENCODING_PROFILE)
+    manifest = get_manifest(index)
+    keys = get_clip_keys(index, clip_segments, width, height)
+
+    clip_name_pattern = re.compile(rf"{re.escape(index.video_path.stem)}_clip_\d+\.mp4")
+    for path in tag_video_dir.iterdir():
+        if clip_name_pattern.fullmatch(path.name) and str(path) not in keys:
+            logger.debug(f"Removing stale clip '{path}'")
+            path.unlink()
+            silent_remove(str(tag_video_dir.parent / "ann" / f"{path.name}.json"))
+            manifest.forget(path)
+
+    missing = [seg for seg in clip_segments if not manifest.is_valid(seg[2], keys[str(seg[2])])]
+    logger.debug(
+        f"Reusing {len(clip_segments) - len(missing)}/{len(clip_segments)} clips "
+        f"of '{index.video_path}' in '{tag_video_dir}'"
+    )
+    if missing:
+        if clip_source is None:
+            clip_source = get_clip_source(index, width, height, threads)
+
+        def on_written(segments: list):
+            for _, _, output_clip in segments:
+                manifest.record(output_clip, keys[str(output_clip)])
+            manifest.save()
+
+        fps = index.media_info.fps
+        extract_clips(
+            clip_source.path,
+            missing,
+            width,
+            height,
+            fps,
+            threads,
+            clip_source.frame_index,
+            on_written=on_written,
+            profile=profile,
+            stream_copy=clip_source.stream_copy,
+            backend=g.EXTRACTION_BACKEND,
+        )
+    manifest.save()
 
-    return info
 
+def get_tag_dir(output_dir: str, tag: str) -> Path:
+    tag_name = tag.replace("/", "-").replace(" ", "_")
+    return Path(output_dir) / tag_name
 
-def make_positives(input_dir: str, output_dir: str, min_size):
-    p = Path(input_dir)
-    paths = list(p.rglob("*.MP4"))
-    paths += list(p.rglob("*.mp4"))
-    logger.info(f"Found {len(paths)} video files.")
 
-    # find duplicates
-    paths = unique_video_names(paths)
-    LABELS = {"Self-Grooming": 1, "Head/Body TWITCH": 2}
-
-    infos = []
-    with g.PROGRESS_BAR(message="Making positive training clips", total=len(paths)) as pbar:
-        g.PROGRESS_BAR.show()
-        for i, video_file in enumerate(paths):
-            ann_file = video_file.parent.parent / f"ann/{video_file.name}.json"
-            if not ann_file.exists():
-                logger.warn(f"Annotation file not found: {ann_file}")
-                pbar.update(1)
-                continue
-
-            for tag, label in LABELS.items():
-                curr_video_infos = make_pos_clips_for_tag(
-                    video_file, ann_file, output_dir, min_size, tag, label
-                )
-                if len(curr_video_infos) == 0:
-                    logger.debug(f"No clips found for video: {video_file}")
-                infos.extend(curr_video_infos)
+def plan_pos_clips_for_tag(
+    index: AnnotationIndex, output_dir: str, target_short_edge: int, tag: str, label: int
+) -> List[PlannedClip]:
+    video_path = index.video_path
+    video_name = video_path.stem
+    tag_video_dir = get_tag_dir(output_dir, tag) / "video"
 
-            logger.info(f"Processed {i+1}/{len(paths)} videos for positive clips")
-            pbar.update(1)
-    g.PROGRESS_BAR.hide()
-    return infos
+    media_info = index.media_info
+    new_width, new_height = calculate_resize(
+        media_info.width, media_info.height, target_short_edge=target_short_edge
+    )
+    ranges = index.ranges[normalize_label(tag)]
+
+    clips = []
+    for clip_counter, (seg_start, seg_end) in enumerate(
+        split_ranges(ranges, media_info.fps, media_info.total_frames), start=1
+    ):
+        clip_name = f"{video_name}_clip_{clip_counter:03d}.mp4"
+        clips.append(
+            PlannedClip(
+                orig_file=str(video_path),
+                clip_file=str(tag_video_dir / clip_name),
+                tag=tag,
+                label=label,
+                start=seg_start,
+                end=seg_end,
+                width=new_width,
+                height=new_height,
+            )
+        )
+    return clips
 
 
-def make_neg_clips_for_tag(
-    video_file: str,
+def plan_neg_clips_for_tag(
+    index: AnnotationIndex,
     output_dir: str,
     target_short_edge: int,
     target_length: int,
-    skip_ranges: list,
+    seed: int,
+    keyframes: Optional[List[int]] = None,
     tag: str = "idle",
     label: int = 0,
     min_clip_duration: int = 3,
     max_clip_duration: int = 5,
-):
-    video_path = Path(video_file)
-    video_name = video_path.stem
-    out_dir = Path(output_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    tag_name = tag.replace("/", "-").replace(" ", "_")
-    tag_dir = out_dir / tag_name
-    tag_dir.mkdir(parents=True, exist_ok=True)
-
-    tag_video_dir = tag_dir / "video"
-    tag_video_dir.mkdir(parents=True, exist_ok=True)
+) -> List[PlannedClip]:
+    """Sample negative clips outside of all positive clips.
 
-    tag_ann_dir = tag_dir / "ann"
-    tag_ann_dir.mkdir(parents=True, exist_ok=True)
-
-    fps = get_fps(video_path)
-    total_frames = get_total_frames(video_path)
-    skip_ranges = merge_overlapping_ranges(skip_ranges)
+    If keyframes are given, clips start on them so they can be stream copied.
+    """
+    video_path = index.video_path
+    video_name = video_path.stem
+    tag_video_dir = get_tag_dir(output_dir, tag) / "video"
 
-    non_skip_intervals = []
-    current = 0
-    for s, e in skip_ranges:
-        if current < s:
-            non_skip_intervals.append([current, s - 1])
-        current = e + 1
-    if current < total_frames:
-        non_skip_intervals.append([current, total_frames - 1])
+    media_info = index.media_info
+    fps = media_info.fps
+    new_width, new_height = calculate_resize(
+        media_info.width, media_info.height, target_short_edge=target_short_edge
+    )
+    non_skip_intervals = index.occupied.complement(0, media_info.total_frames - 1)
 
+    # seeded per run and video so the plan does not depend on video order or workers
+    rng = random.Random(f"{seed}:{video_name}")
     clip_min_frames = math.ceil(fps * min_clip_duration)
     clip_max_frames = math.floor(fps * max_clip_duration)
     clip_counter = 1
     cumulative_clip_frames = 0
-    info = []
+    clips = []
 
     for interval in non_skip_intervals:
         interval_start, interval_end = interval
         t = interval_start
         while t + clip_min_frames - 1 <= interval_end and cumulative_clip_frames < target_length:
+            if keyframes is not None:
+                i = bisect_left(keyframes, t)
+                if i == len(keyframes):
+                    break
+                t = keyframes[i]
             available = interval_end - t + 1
             if available < clip_min_frames:
                 break
-            clip_length = random.randint(clip_min_frames, min(clip_max_frames, int(available)))
+            clip_length = rng.randint(clip_min_frames, min(clip_max_frames, int(available)))
             start_frame = t
             end_frame = t + clip_length - 1
             clip_name = f"{video_name}_clip_{clip_counter:03d}.mp4"
-            output_clip = tag_video_dir / clip_name
-            output_clip.parent.mkdir(parents=True, exist_ok=True)
-            width, height = get_video_dimensions(video_path)
-            new_width, new_height = calculate_resize(
-                width, height, target_short_edge=target_short_edge
-            )
-            extract_clip(
-                video_path, start_frame, end_frame, new_width, new_height, fps, output_clip
+            clips.append(
+                PlannedClip(
+                    orig_file=str(video_path),
+                    clip_file=str(tag_video_dir / clip_name),
+                    tag=tag,
+                    label=label,
+                    start=start_frame,
+                    end=end_frame,
+                    width=new_width,
+                    height=new_height,
+                )
             )
 
-            ann_file = tag_ann_dir / clip_name.replace(".mp4", ".mp4.json")
-            ann = VideoAnnotation((new_width, new_height), clip_length)
-            dump_json_file(ann.to_json(), ann_file)
-
-            # orig_file, clip_file, start, end, label=0
-            info.append([str(video_path), str(output_clip), start_frame, end_frame, label])
-
             cumulative_clip_frames += clip_length
             clip_counter += 1
             t = end_frame + 1
             if cumulative_clip_frames >= target_length:
                 break
 
-    return info
+    return clips
+
+
+def map_videos(func, tasks: list, workers: int, scratch_space: Optional[ScratchSpace] = None):
+    """Run func over per-video argument tuples, yielding results in task order.
+
+    If scratch_space is given, no new task starts while it is over budget: finished results
+    are handed to the caller first, then it waits for a running consumer to release space.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            if scratch_space is not None:
+                scratch_space.wait_for_space()
+            yield func(*task)
+        return
+    # the decoding and encoding runs in ffmpeg subprocesses, threads only wait for them;
+    # forking this process is unsafe once the uploader and download threads are running
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clips") as executor:
+        pending = deque()
+        for task in tasks:
+            # hand finished results to the caller first, its consumers free scratch space
+            while len(pending) >= workers or (
+                pending and scratch_space is not None and scratch_space.over_budget()
+            ):
+                yield pending.popleft().result()
+            if scratch_space is not None:
+                scratch_space.wait_for_space()
+            pending.append(executor.submit(func, *task))
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_ffmpeg_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def get_source_keyframes(index: AnnotationIndex, width: int, height: int) -> Optional[List[int]]:
+    """Keyframes of the clip source if its clips of this size can be stream copied.
+
+    Proxies are not made for this; they are encoded at the clip size so their clips can
+    be copied, and their keyframes follow from the fixed proxy GOP.
+    """
+    media_info = index.media_info
+    if g.USE_PROXY:
+        return get_proxy_keyframes(media_info)
+    if not can_stream_copy(media_info, width, height):
+        return None
+    return probe_frame_index(index.video_path, g.MEDIA_CACHE_DIR).keyframes
+
+
+def get_copy_keyframes(index: AnnotationIndex, target_short_edge: int) -> Optional[List[int]]:
+    media_info = index.media_info
+    width, height = calculate_resize(
+        media_info.width, media_info.height, target_short_edge=target_short_edge
+    )
+    return get_source_keyframes(index, width, height)
+
+
+def warm_probe_caches(video_path: str, target_short_edge: int = None) -> None:
+    """Probe a training video as soon as it is split, so clip planning reads cached results
+    instead of probing every video after the last download."""
+    if target_short_edge is None:
+        target_short_edge = g.CLIP_SHORT_EDGE
+    media_info = probe_video(video_path, g.MEDIA_CACHE_DIR)
+    if not g.STREAM_COPY_CLIPS or g.USE_PROXY:
+        return
+    width, height = calculate_resize(
+        media_info.width, media_info.height, target_short_edge=target_short_edge
+    )
+    if can_stream_copy(media_info, width, height):
+        probe_frame_index(video_path, g.MEDIA_CACHE_DIR)
+
+
+def plan_training_clips(
+    indices: List[AnnotationIndex], output_dir: str, min_size: int, seed: int
+) -> ClipPlan:
+    """Compute every positive and negative clip of all training videos without encoding."""
+    pos_clips = {}
+    for index in indices:
+        pos_clips[index.video_path] = []
+        for tag, label in LABELS.items():
+            pos_clips[index.video_path] += plan_pos_clips_for_tag(
+                index, output_dir, min_size, tag, label
+            )
 
+    # negatives get the average positive length of the videos that have positives
+    total_lengths = [sum(c.length for c in clips) for clips in pos_clips.values() if clips]
+    target_length = int(sum(total_lengths) / len(total_lengths) if total_lengths else 300)
+
+    # negatives are only made for videos that produced positive clips
+    neg_indices = [index for index in indices if index.occupied]
+    keyframes = [None] * len(neg_indices)
+    if g.STREAM_COPY_CLIPS:
+        tasks = [(index, min_size) for index in neg_indices]
+        keyframes = list(map_videos(get_copy_keyframes, tasks, g.CLIP_WORKERS))
+
+    plan = ClipPlan(seed=seed, target_length=target_length)
+    for index in indices:
+        plan.clips += pos_clips[index.video_path]
+    for index, video_keyframes in zip(neg_indices, keyframes):
+        plan.clips += plan_neg_clips_for_tag(
+            index, output_dir, min_size, target_length, seed, video_keyframes
+        )
+    return plan
+
+
+def count_missing_clips(indices: List[AnnotationIndex], plan: ClipPlan) -> List[PlannedClip]:
+    """Planned clips that are not in the clip manifests yet and have to be encoded."""
+    clips_by_video = defaultdict(list)
+    for clip in plan.clips:
+        clips_by_video[clip.orig_file].append(clip)
+
+    missing = []
+    for index in indices:
+        clips = clips_by_video.get(str(index.video_path), [])
+        if not clips:
+            continue
+        manifest = get_manifest(index)
+        segments = [(clip.start, clip.end, clip.clip_file) for clip in clips]
+        keys = get_clip_keys(index, segments, clips[0].width, clips[0].height)
+        missing += [
+            clip for clip in clips if not manifest.is_valid(clip.clip_file, keys[clip.clip_file])
+        ]
+    return missing
 
-def make_negatives(pos_df: pd.DataFrame, output_dir: str, min_size, target_length):
-    grouped = pos_df.groupby("orig_file")
-    infos = []
 
-    with g.PROGRESS_BAR(message="Making negative training clips", total=len(grouped)) as pbar:
-        g.PROGRESS_BAR.show()
-        for i, (video_file, group_df) in enumerate(grouped):
-            skip_ranges = group_df[["start", "end"]].values.tolist()
-            infos += make_neg_clips_for_tag(
-                video_file,
-                output_dir,
-                min_size,
-                target_length=target_length,
-                skip_ranges=skip_ranges,
+def log_plan(indices: List[AnnotationIndex], plan: ClipPlan, previous: Optional[ClipPlan]):
+    missing = count_missing_clips(indices, plan)
+    logger.info(
+        f"Clip plan (seed {plan.seed}): {len(plan.clips)} clips, {plan.total_frames()} frames; "
+        f"{len(missing)} clips with {sum(clip.length for clip in missing)} frames to encode"
+    )
+    if previous is not None:
+        added, removed = diff_plans(previous, plan)
+        logger.info(
+            f"Compared to the previous plan: {len(added)} clips added, {len(removed)} removed"
+        )
+
+
+def make_clips_for_video(
+    index: AnnotationIndex, clips: List[PlannedClip], output_dir: str, threads: int
+) -> List[ClipRecord]:
+    """Execute the plan of one video, tag by tag."""
+    clips_by_tag = {tag: [] for tag in [*LABELS, "idle"]}
+    for clip in clips:
+        clips_by_tag[clip.tag].append(clip)
+
+    records = []
+    for tag, tag_clips in clips_by_tag.items():
+        tag_dir = get_tag_dir(output_dir, tag)
+        tag_video_dir = tag_dir / "video"
+        tag_ann_dir = tag_dir / "ann"
+        tag_video_dir.mkdir(parents=True, exist_ok=True)
+        tag_ann_dir.mkdir(parents=True, exist_ok=True)
+        if not tag_clips and tag != "idle":
+            logger.debug(f"No clips found for video: {index.video_path}")
+
+        segments = [(clip.start, clip.end, Path(clip.clip_file)) for clip in tag_clips]
+        # called for empty tags too, so stale clips of this video are removed
+        width, height = (tag_clips[0].width, tag_clips[0].height) if tag_clips else (0, 0)
+        write_clips(index, tag_video_dir, segments, width, height, threads)
+
+        for clip in tag_clips:
+            ann_file = tag_ann_dir / f"{os.path.basename(clip.clip_file)}.json"
+            ann = VideoAnnotation((clip.width, clip.height), clip.length)
+            dump_json_file(ann.to_json(), ann_file)
+            records.append(
+                ClipRecord(clip.orig_file, clip.clip_file, clip.start, clip.end, clip.label)
             )
-            logger.info(f"Processed {i+1}/{len(grouped)} videos for negative clips")
+
+    if g.USE_PROXY and g.DELETE_PROXIES:
+        media_info = index.media_info
+        scratch.release(
+            get_proxy_path(media_info, clips[0].width, clips[0].height, g.MEDIA_CACHE_DIR),
+            delete=True,
+        )
+    return records
+
+
+def execute_plan(
+    indices: List[AnnotationIndex],
+    plan: ClipPlan,
+    output_dir: str,
+    workers: int = 1,
+    on_video_done: Optional[Callable[[List[ClipRecord]], None]] = None,
+) -> List[ClipRecord]:
+    threads = get_ffmpeg_threads(workers)
+    clips_by_video = defaultdict(list)
+    for clip in plan.clips:
+        clips_by_video[clip.orig_file].append(clip)
+    tasks = [
+        (index, clips_by_video[str(index.video_path)], output_dir, threads)
+        for index in indices
+        if clips_by_video[str(index.video_path)]
+    ]
+
+    records = []
+    with g.PROGRESS_BAR(message="Making training clips", total=len(tasks)) as pbar:
+        g.PROGRESS_BAR.show()
+        video_results = map_videos(make_clips_for_video, tasks, workers, scratch)
+        for i, (task, video_records) in enumerate(zip(tasks, video_results)):
+            # the split copy of the source is not needed once its clips are made
+            scratch.release(task[0].video_path)
+            for record in video_records:
+                scratch.add("clips", record.clip_file)
+            records += video_records
+            if on_video_done is not None:
+                on_video_done(video_records)
+            logger.info(f"Processed {i+1}/{len(tasks)} videos for training clips")
             pbar.update(1)
     g.PROGRESS_BAR.hide()
-    return infos
+    return records
 
 
 def unique_video_names(paths: list):
@@ -416,7 +649,22 @@ def remove_train_videos():
     clean_dir(train_ann_dir)
 
 
-def make_training_clips(min_size=480):
+def make_training_clips(
+    min_size: int = None,
+    on_clips: Optional[Callable[[List[VideoMetaData]], None]] = None,
+    dry_run: bool = False,
+    require_positives: bool = True,
+):
+    """Plan positive and negative clips of all training videos, then make them.
+
+    The plan is saved to g.CLIP_PLAN_PATH. With dry_run only the plan is made, summarized
+    and saved to g.DRY_RUN_PLAN_PATH. Clips are added to g.TRAIN_VIDEOS as soon as a video is done;
+    on_clips is called with the new clips of every video, e.g. to upload them while
+    encoding continues. min_size is the short edge of the clips, g.CLIP_SHORT_EDGE by default.
+    Without require_positives, a plan without positive clips makes no clips instead of failing.
+    """
+    if min_size is None:
+        min_size = g.CLIP_SHORT_EDGE
     csv_path = g.SPLIT_PROJECT_DIR
     train_dir = os.path.join(g.SPLIT_PROJECT_DIR, "train")
     output_dir = os.path.join(train_dir, "datasets")
@@ -426,80 +674,63 @@ def make_training_clips(min_size=480):
     train_dir = Path(train_dir)
     train_dir.mkdir(parents=True, exist_ok=True)
 
-    logger.info("Creating positive clips...")
-    pos_infos = make_positives(input_dir=train_dir, output_dir=output_dir, min_size=min_size)
-    if not pos_infos:
+    # clips of earlier runs are kept under output_dir, so only the split videos are listed
+    paths = list((train_dir / "video").glob("*.MP4"))
+    paths += list((train_dir / "video").glob("*.mp4"))
+    logger.info(f"Found {len(paths)} video files.")
+    # find duplicates
+    paths = unique_video_names(paths)
+    indices = build_annotation_indices(paths, list(LABELS.keys()))
+
+    logger.info("Planning clips...")
+    plan = plan_training_clips(indices, str(output_dir), min_size, g.CLIP_PLAN_SEED)
+    if not any(clip.label != 0 for clip in plan.clips):
+        if not require_positives:
+            logger.warning(f"No positive clips in {len(indices)} training videos")
+            return
         logger.error("No positive clips created. Check annotations and videos.")
         raise RuntimeError("No positive clips created. Check annotations and videos.")
+    log_plan(indices, plan, load_plan(g.CLIP_PLAN_PATH))
+    logger.info(f"Average target length for negatives: {plan.target_length} frames")
+    if dry_run:
+        # the plan of the last real run stays the one the next run is compared with
+        save_plan(plan, g.DRY_RUN_PLAN_PATH)
+        return g.DRY_RUN_PLAN_PATH
+    save_plan(plan, g.CLIP_PLAN_PATH)
+
+    def add_clips(records: List[ClipRecord]):
+        clips = attach_clips_to_videos(records, g.TRAIN_VIDEOS)
+        # the downloaded source is not needed once its clips are made
+        for source_video in {id(clip.source_video): clip.source_video for clip in clips}.values():
+            if source_video.download_path is not None:
+                scratch.release(source_video.download_path)
+        if on_clips is not None:
+            on_clips(clips)
+
+    logger.info("Creating clips...")
+    records = execute_plan(
+        indices, plan, str(output_dir), workers=g.CLIP_WORKERS, on_video_done=add_clips
+    )
+    scratch.log_usage()
+    pos_infos = [record for record in records if record.label != 0]
+    neg_infos = [record for record in records if record.label == 0]
 
-    pos_df = pd.DataFrame(pos_infos, columns=["orig_file", "clip_file", "start", "end", "label"])
     pos_csv_path = os.path.join(csv_path, "positives.csv")
-    pos_df.to_csv(pos_csv_path, index=False)
+    write_clip_records(pos_infos, pos_csv_path)
     logger.info(f"Saved {len(pos_infos)} positive clips to '{pos_csv_path}'")
 
     # Calculate average frame range length per video file
-    pos_df["range_length"] = (
-        pos_df["end"] - pos_df["start"] + 1
-    )  # +1 because end frame is inclusive
-    avg_lengths = pos_df.groupby("orig_file")["range_length"].agg(["sum", "count", "mean"])
-    avg_lengths.columns = ["total_frames", "clip_count", "avg_length_per_clip"]
-    avg_lengths.to_csv(os.path.join(csv_path, "avg_lengths_positives.csv"))
-
-    target_length = int(avg_lengths["total_frames"].mean() if not avg_lengths.empty else 300)
-    logger.info(f"Average target length for negatives: {target_length} frames")
-
-    # Create negative clips
-    logger.info("Creating negative clips...")
-    neg_infos = make_negatives(
-        pos_df=pos_df, output_dir=output_dir, min_size=min_size, target_length=target_length
-    )
-    neg_df = pd.DataFrame(neg_infos, columns=["orig_file", "clip_file", "start", "end", "label"])
+    write_positive_lengths(pos_infos, os.path.join(csv_path, "avg_lengths_positives.csv"))
+
     neg_csv_path = os.path.join(csv_path, "negatives.csv")
-    neg_df.to_csv(neg_csv_path, index=False)
+    write_clip_records(neg_infos, neg_csv_path)
     logger.info(f"Saved {len(neg_infos)} negative clips to '{neg_csv_path}'")
 
     # concatenate positive and negative clips
-    clips_df = pd.concat([pos_df, neg_df])
+    clip_records = pos_infos + neg_infos
     clips_csv_path = os.path.join(csv_path, "clips.csv")
-    clips_df.to_csv(clips_csv_path, index=False)
-    logger.info(f"Saved {len(clips_df)} total clips to '{clips_csv_path}'")
-
-    # Add clips information to g.TRAIN_VIDEOS
-    # Create a dictionary for quick video search by filename
-    video_dict = {}
-    for video in g.TRAIN_VIDEOS:
-        video_name = os.path.basename(video.path) if video.path else video.name
-        video_dict[video_name] = video
-
-    # For each clip, create a VideoMetaData object and add it to the corresponding source video
-    for _, row in clips_df.iterrows():
-        # Get the filename of the source video
-        source_file = os.path.basename(row["orig_file"])
-
-        # Find the corresponding VideoMetaData object
-        if source_file in video_dict:
-            source_video = video_dict[source_file]
-
-            # Define the label
-            if isinstance(row["label"], int):
-                # Ensure the label is within the valid range
-                if 0 <= row["label"] < len(g.CLIP_LABELS):
-                    label = g.CLIP_LABELS[row["label"]]
-                else:
-                    label = f"label_{row['label']}"
-            else:
-                label = row["label"]
-
-            clip = VideoMetaData.create_clip(
-                source_video=source_video,
-                name=os.path.basename(row["clip_file"]),
-                start_frame=row["start"],
-                end_frame=row["end"],
-                label=label,
-            )
-
-            clip.path = row["clip_file"]
-            source_video.clips.append(clip)
+    write_clip_records(clip_records, clips_csv_path)
+    logger.info(f"Saved {len(clip_records)} total clips to '{clips_csv_path}'")
 
     # Remove original train videos
     remove_train_videos()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+from supervisely import logger
+
+# Bytes hashed from the head and the tail of a file to fingerprint its content
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+# Seconds of packets scanned to estimate the keyframe interval
+KEYFRAME_SCAN_DURATION = 30
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    width: int
+    height: int
+    fps: float
+    total_frames: int
+    duration: float
+    codec: str
+    pix_fmt: str
+    keyframe_interval: Optional[int]
+    fingerprint: str
+    has_b_frames: bool
+
+
+@dataclass(frozen=True)
+class FrameIndex:
+    """Presentation timestamp of every frame and the frame numbers of all keyframes.
+
+    Frame n is the n-th frame in presentation order, like frame numbers in annotations.
+    pts_times are kept as printed by ffprobe, so -ss gets the exact timestamp.
+    """
+
+    pts_times: List[str]
+    keyframes: List[int]
+
+    def __len__(self) -> int:
+        return len(self.pts_times)
+
+    def is_keyframe(self, frame: int) -> bool:
+        i = bisect_left(self.keyframes, frame)
+        return i < len(self.keyframes) and self.keyframes[i] == frame
+
+    def preceding_keyframe(self, frame: int) -> int:
+        """Last keyframe at or before frame; decoding from it reaches frame exactly."""
+        i = bisect_right(self.keyframes, frame)
+        return self.keyframes[i - 1] if i > 0 else 0
+
+    def next_keyframe(self, frame: int) -> Optional[int]:
+        """First keyframe at or after frame."""
+        i = bisect_left(self.keyframes, frame)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def seconds(self, frame: int) -> float:
+        return float(self.pts_times[frame])
+
+
+_fingerprints: Dict[Tuple[str, int, int], str] = {}
+_probes: Dict[str, MediaInfo] = {}
+_frame_indices: Dict[str, FrameIndex] = {}
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+
+
+def file_fingerprint(path: str) -> str:
+    """Cheap content hash: file size plus the first and last megabyte.
+
+    Copies and hardlinks of the same video get the same fingerprint, so cached
+    results survive the move from the download cache to the split directory.
+    """
+    key = _stat_key(path)
+    if key in _fingerprints:
+        return _fingerprints[key]
+
+    size = key[1]
+    sha = hashlib.sha1(str(size).encode("utf-8"))
+    with open(path, "rb") as f:
+        sha.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(FINGERPRINT_CHUNK_SIZE, size - FINGERPRINT_CHUNK_SIZE))
+            sha.update(f.read(FINGERPRINT_CHUNK_SIZE))
+    fingerprint = sha.hexdigest()
+    _fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def _parse_rate(rate: str) -> float:
+    if not rate or rate == "0/0":
+        return 0.0
+    if "/" in rate:
+        numerator, denominator = rate.split("/")
+        return int(numerator) / int(denominator)
+    return float(rate)
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _estimate_keyframe_interval(packets: list, fps: float) -> Optional[int]:
+    key_times = sorted(
+        float(packet["pts_time"])
+        for packet in packets
+        if "K" in packet.get("flags", "") and _to_float(packet.get("pts_time")) is not None
+    )
+    if len(key_times) < 2:
+        return None
+    gaps = sorted(b - a for a, b in zip(key_times, key_times[1:]))
+    return max(1, round(gaps[len(gaps) // 2] * fps))
+
+
+def _run_ffprobe(video_path: str, fingerprint: str) -> MediaInfo:
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-read_intervals",
+        f"%+{KEYFRAME_SCAN_DURATION}",
+        "-show_entries",
+        "stream=width,height,r_frame_rate,nb_frames,duration,codec_name,pix_fmt,has_b_frames"
+        ":format=duration:packet=pts_time,flags",
+        "-of",
+        "json",
+        str(video_path),
+    ]
+    output = json.loads(subprocess.check_output(cmd).decode("utf-8"))
+    stream = output["streams"][0]
+    fps = _parse_rate(stream.get("r_frame_rate"))
+    duration = _to_float(stream.get("duration"))
+    if duration is None:
+        duration = _to_float(output.get("format", {}).get("duration")) or 0.0
+
+    nb_frames = stream.get("nb_frames")
+    if nb_frames and nb_frames != "N/A":
+        total_frames = int(nb_frames)
+    else:
+        logger.warning(
+            f"Frame count not found in metadata of '{video_path}'. Estimating it from duration."
+        )
+        total_frames = int(duration * fps)
+
+    return MediaInfo(
+        width=int(stream["width"]),
+        height=int(stream["height"]),
+        fps=fps,
+        total_frames=total_frames,
+        duration=duration,
+        codec=stream.get("codec_name", ""),
+        pix_fmt=stream.get("pix_fmt", ""),
+        keyframe_interval=_estimate_keyframe_interval(output.get("packets", []), fps),
+        fingerprint=fingerprint,
+        has_b_frames=int(stream.get("has_b_frames") or 0) > 0,
+    )
+
+
+def _probe_cache_path(cache_dir: str, fingerprint: str) -> str:
+    return os.path.join(cache_dir, "probe", f"{fingerprint}.json")
+
+
+def _load_probe(cache_dir: str, fingerprint: str) -> Optional[MediaInfo]:
+    path = _probe_cache_path(cache_dir, fingerprint)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        # records written before a field was added are probed again
+        if set(data) != {field.name for field in fields(MediaInfo)}:
+            return None
+        return MediaInfo(**data)
+    except Exception as e:
+        logger.warning(f"Error loading probe cache '{path}': {str(e)}")
+        return None
+
+
+def _dump_json_atomic(data, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _save_probe(cache_dir: str, media_info: MediaInfo) -> None:
+    _dump_json_atomic(asdict(media_info), _probe_cache_path(cache_dir, media_info.fingerprint))
+
+
+def probe_video(video_path: str, cache_dir: Optional[str] = None) -> MediaInfo:
+    """Probe a video once and memoize the result in memory and, if given, in cache_dir."""
+    fingerprint = file_fingerprint(str(video_path))
+    if fingerprint in _probes:
+        return _probes[fingerprint]
+
+    media_info = _load_probe(cache_dir, fingerprint) if cache_dir else None
+    if media_info is None:
+        media_info = _run_ffprobe(video_path, fingerprint)
+        if cache_dir:
+            _save_probe(cache_dir, media_info)
+    _probes[fingerprint] = media_info
+    return media_info
+
+
+def _run_frame_scan(video_path: str) -> FrameIndex:
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        str(video_path),
+    ]
+    output = subprocess.check_output(cmd).decode("utf-8")
+    packets = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if _to_float(pts_time) is not None:
+            packets.append((float(pts_time), pts_time, "K" in flags))
+    # packets come in decode order, frame numbers follow presentation order
+    packets.sort(key=lambda x: x[0])
+    return FrameIndex(
+        pts_times=[packet[1] for packet in packets],
+        keyframes=[i for i, packet in enumerate(packets) if packet[2]],
+    )
+
+
+def probe_frame_index(video_path: str, cache_dir: Optional[str] = None) -> FrameIndex:
+    """Build the frame index of a video with one pass over its packets (no decoding).
+
+    Cached in memory and, if given, in cache_dir like probe_video.
+    """
+    fingerprint = file_fingerprint(str(video_path))
+    if fingerprint in _frame_indices:
+        return _frame_indices[fingerprint]
+
+    path = os.path.join(cache_dir, "frame_index", f"{fingerprint}.json") if cache_dir else None
+    frame_index = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                frame_index = FrameIndex(**json.load(f))
+        except Exception as e:
+            logger.warning(f"Error loading frame index cache '{path}': {str(e)}")
+
+    if frame_index is None:
+        frame_index = _run_frame_scan(video_path)
+        if path:
+            _dump_json_atomic(asdict(frame_index), path)
+    _frame_indices[fingerprint] = frame_index
+    return frame_index
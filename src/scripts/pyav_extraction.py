@@ -0,0 +1,252 @@
+"""In-process clip extraction with PyAV.
+
+The source is opened once per video and decoded sequentially; every decoded frame is
+scaled once and sent to all clip encoders that cover it. Selected with
+g.EXTRACTION_BACKEND = "pyav", see clip_extraction.extract_clips.
+"""
+
+from bisect import bisect_left
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from supervisely import logger
+
+from src.scripts.clip_extraction import (
+    DEFAULT_ENCODING_PROFILE,
+    EncodingProfile,
+    Segment,
+    group_segments,
+)
+from src.scripts.media_probe import FrameIndex
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# add_stream_from_template() appeared in 13.0, 14.0 removed add_stream(template=...)
+AV_SUPPORTED_VERSIONS = ((13, 0), (19, 0))
+
+
+def _av_version() -> tuple:
+    return tuple(int(part) for part in av.__version__.split(".")[:2])
+
+
+class _ClipWriter:
+    def __init__(
+        self,
+        segment: Segment,
+        width: int,
+        height: int,
+        fps: float,
+        time_base: Fraction,
+        profile: EncodingProfile,
+        threads: Optional[int] = None,
+    ):
+        self.start, self.end, self.output_clip = segment
+        self.first_pts = None
+        self.container = av.open(str(self.output_clip), "w")
+        self.stream = self.container.add_stream("libx264", rate=Fraction(fps).limit_denominator())
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.time_base = time_base
+        self.stream.codec_context.time_base = time_base
+        # gop_duration=0 gives a GOP of one frame, like the ffmpeg backend
+        self.stream.codec_context.gop_size = max(1, round(profile.gop_duration * fps))
+        options = {"preset": profile.preset, "crf": str(profile.crf)}
+        if profile.tune:
+            options["tune"] = profile.tune
+        if threads:
+            options["threads"] = str(threads)
+        self.stream.options = options
+
+    def write(self, frame, pts: int) -> None:
+        if self.first_pts is None:
+            self.first_pts = pts
+        frame.pts = pts - self.first_pts
+        frame.time_base = self.stream.time_base
+        self.container.mux(self.stream.encode(frame))
+
+    def close(self) -> None:
+        self.container.mux(self.stream.encode(None))
+        self.container.close()
+
+
+def _frame_numbers(frame_index: Optional[FrameIndex], fps: float):
+    """Return a function mapping a decoded frame to its frame number."""
+    if frame_index is None:
+        return lambda frame: round(frame.time * fps)
+    seconds = [float(pts_time) for pts_time in frame_index.pts_times]
+    # half a frame of tolerance for timestamps rounded by ffprobe
+    tolerance = 0.5 / fps
+    return lambda frame: bisect_left(seconds, frame.time - tolerance)
+
+
+def _seek(container, stream, frame: int, fps: float, frame_index: Optional[FrameIndex]):
+    if frame_index is not None and frame < len(frame_index):
+        seconds = frame_index.seconds(frame_index.preceding_keyframe(frame))
+    else:
+        seconds = frame / fps
+    # backward seek lands on the keyframe at or before the timestamp
+    container.seek(round(seconds / stream.time_base), stream=stream, backward=True)
+
+
+def _transcode_group(
+    container,
+    group: List[Segment],
+    width: int,
+    height: int,
+    fps: float,
+    frame_number,
+    frame_index: Optional[FrameIndex],
+    profile: EncodingProfile,
+    threads: Optional[int],
+) -> List[Segment]:
+    """Returns the segments written completely; the video may end before the others."""
+    stream = container.streams.video[0]
+    group_start = group[0][0]
+    group_end = max(end for _, end, _ in group)
+    _seek(container, stream, group_start, fps, frame_index)
+
+    pending = list(group)
+    writers: List[_ClipWriter] = []
+    written = []
+    try:
+        for frame in container.decode(stream):
+            if frame.pts is None:
+                continue
+            n = frame_number(frame)
+            if n < group_start:
+                continue
+            while pending and pending[0][0] <= n:
+                writers.append(
+                    _ClipWriter(
+                        pending.pop(0), width, height, fps, stream.time_base, profile, threads
+                    )
+                )
+            if not writers:
+                continue
+            # scaled once, every encoder takes its own reference when the frame is sent
+            scaled = frame.reformat(width=width, height=height, format="yuv420p")
+            for writer in writers:
+                if writer.start <= n <= writer.end:
+                    writer.write(scaled, frame.pts)
+            for writer in [writer for writer in writers if n >= writer.end]:
+                writer.close()
+                writers.remove(writer)
+                written.append((writer.start, writer.end, writer.output_clip))
+            if n >= group_end:
+                break
+    finally:
+        for writer in writers:
+            writer.close()
+    return written
+
+
+def _copy_segment(container, segment: Segment, frame_index: FrameIndex) -> List[Segment]:
+    """Remux the packets of a segment starting on a keyframe, like ffmpeg -c copy.
+    Returns the segment if the video did not end before its last frame."""
+    start, end, output_clip = segment
+    stream = container.streams.video[0]
+    start_pts = round(frame_index.seconds(start) / stream.time_base)
+    container.seek(start_pts, stream=stream, backward=True)
+    with av.open(str(output_clip), "w") as output:
+        out_stream = output.add_stream_from_template(stream)
+        first_pts = None
+        count = 0
+        # sources that can be copied have no B-frames, so decode order is presentation order
+        for packet in container.demux(stream):
+            # a seek may land on an earlier keyframe
+            if packet.pts is None or packet.size == 0 or packet.pts < start_pts:
+                continue
+            if first_pts is None:
+                first_pts = packet.pts
+            packet.pts -= first_pts
+            packet.dts = packet.pts
+            packet.stream = out_stream
+            output.mux(packet)
+            count += 1
+            if count == end - start + 1:
+                break
+    return [segment] if count == end - start + 1 else []
+
+
+def _run_av(func, segments: List[Segment], *args):
+    try:
+        return func(*args)
+    except av.error.FFmpegError as e:
+        logger.error(f"PyAV error: {str(e)}")
+        logger.error(f"frame ranges: {[(start, end) for start, end, _ in segments]}")
+        raise
+
+
+def extract_clips_pyav(
+    video_path: Path,
+    segments: List[Segment],
+    width: int,
+    height: int,
+    fps: float,
+    threads: Optional[int] = None,
+    frame_index: Optional[FrameIndex] = None,
+    on_written: Optional[Callable[[List[Segment]], None]] = None,
+    profile: EncodingProfile = DEFAULT_ENCODING_PROFILE,
+    stream_copy: bool = False,
+) -> None:
+    """PyAV version of clip_extraction.extract_clips with the same arguments."""
+    if av is None:
+        raise ImportError("PyAV is not installed, install 'av' or use the ffmpeg backend")
+    min_version, max_version = AV_SUPPORTED_VERSIONS
+    if not min_version <= _av_version() < max_version:
+        raise ImportError(
+            f"PyAV {av.__version__} is not supported, install 'av>=13.0,<19.0' "
+            "or use the ffmpeg backend"
+        )
+
+    for _, _, output_clip in segments:
+        Path(output_clip).parent.mkdir(parents=True, exist_ok=True)
+
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        if threads:
+            stream.codec_context.thread_count = threads
+        stream.thread_type = "AUTO"
+        frame_number = _frame_numbers(frame_index, fps)
+
+        transcode_segments = []
+        incomplete = []
+        for segment in segments:
+            if stream_copy and frame_index.is_keyframe(segment[0]):
+                written = _run_av(_copy_segment, [segment], container, segment, frame_index)
+                if on_written is not None and written:
+                    on_written(written)
+                if not written:
+                    incomplete.append(segment)
+            else:
+                transcode_segments.append(segment)
+
+        for group in group_segments(transcode_segments, fps):
+            written = _run_av(
+                _transcode_group,
+                group,
+                container,
+                group,
+                width,
+                height,
+                fps,
+                frame_number,
+                frame_index,
+                profile,
+                threads,
+            )
+            # only clips that were written completely are reported
+            if on_written is not None and written:
+                on_written(written)
+            incomplete += [segment for segment in group if segment not in written]
+
+    if incomplete:
+        raise RuntimeError(
+            f"Video '{video_path}' ended before the last frame of "
+            f"{len(incomplete)} clips: {[(start, end) for start, end, _ in incomplete]}"
+        )
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from supervisely import logger
+from supervisely.io.fs import silent_remove
+
+import src.globals as g
+
+
+class ScratchSpace:
+    """Bytes of intermediate files written per stage, kept under an optional budget.
+
+    Producers call wait_for_space() before starting more work; consumers call release()
+    when they are done with a file, which deletes it if eager cleanup is enabled.
+    Consumers running on another thread register with start_consumer(), producers only
+    wait while one of them is running. Used from the main process and the uploader thread.
+    """
+
+    def __init__(
+        self, budget: Optional[int] = None, eager_cleanup: bool = True, wait_timeout: float = 600
+    ):
+        self.budget = budget
+        self.eager_cleanup = eager_cleanup
+        self.wait_timeout = wait_timeout
+        self.files: Dict[str, tuple] = {}
+        self.stage_bytes: Dict[str, int] = defaultdict(int)
+        self.consumers = 0
+        self._condition = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return sum(self.stage_bytes.values())
+
+    def add(self, stage: str, path: str) -> None:
+        path = str(path)
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        with self._condition:
+            if path in self.files:
+                old_stage, old_size = self.files[path]
+                self.stage_bytes[old_stage] -= old_size
+            self.files[path] = (stage, size)
+            self.stage_bytes[stage] += size
+
+    def release(self, path: str, delete: Optional[bool] = None) -> None:
+        """The last consumer of path is done; delete it when eager cleanup is on."""
+        path = str(path)
+        if delete is None:
+            delete = self.eager_cleanup
+        with self._condition:
+            if path in self.files:
+                stage, size = self.files.pop(path)
+                self.stage_bytes[stage] -= size
+            if delete:
+                silent_remove(path)
+            self._condition.notify_all()
+
+    def start_consumer(self) -> None:
+        with self._condition:
+            self.consumers += 1
+
+    def stop_consumer(self) -> None:
+        with self._condition:
+            self.consumers -= 1
+            self._condition.notify_all()
+
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.used > self.budget
+
+    def should_wait(self) -> bool:
+        """Over budget, and a consumer is running that can release space."""
+        return self.over_budget() and self.consumers > 0
+
+    def wait_for_space(self) -> None:
+        """Block while over budget and a consumer is running. Gives up after wait_timeout
+        without any release, so a budget smaller than one video's intermediates slows the
+        run down but never stops it. Without a consumer nothing could free space, so the
+        budget is only reported."""
+        if self.budget is None:
+            return
+        with self._condition:
+            if self.over_budget() and self.consumers == 0:
+                logger.debug(
+                    f"Scratch space over budget ({self.used} of {self.budget} bytes), "
+                    "no consumer running to free it"
+                )
+            while self.should_wait():
+                used = self.used
+                logger.debug(
+                    f"Scratch space over budget ({used} of {self.budget} bytes), waiting",
+                    extra={"stages": dict(self.stage_bytes)},
+                )
+                started = time.monotonic()
+                self._condition.wait(self.wait_timeout)
+                if self.used >= used and time.monotonic() - started >= self.wait_timeout:
+                    logger.warning(
+                        f"Scratch space stays over budget ({self.used} of {self.budget} bytes), "
+                        "continuing"
+                    )
+                    return
+
+    def log_usage(self) -> None:
+        logger.info(
+            f"Scratch space: {self.used} bytes in use",
+            extra={"stages": dict(self.stage_bytes), "budget": self.budget},
+        )
+
+
+def _budget_bytes() -> Optional[int]:
+    if g.SCRATCH_BUDGET_GB is None:
+        return None
+    return int(g.SCRATCH_BUDGET_GB * 1024**3)
+
+
+scratch = ScratchSpace(_budget_bytes(), g.EAGER_CLEANUP)
@@ -1,23 +1,71 @@
 import os
 import shutil
+from typing import Iterable, Optional, Sequence
 
 from supervisely import logger
-from supervisely.io.fs import mkdir
+from supervisely.io.fs import clean_dir, mkdir
 from supervisely.io.json import dump_json_file
-from supervisely.project.project import OpenMode
-from supervisely.project.video_project import VideoDataset, VideoProject
 from supervisely.video_annotation.key_id_map import KeyIdMap
 
 import src.globals as g
+from src.scripts.dataset_split import is_train_video
+from src.scripts.file_links import LINK_METHODS, link_or_copy
+from src.scripts.item_index import ItemIndex, ItemPaths
+from src.scripts.make_training_clips import warm_probe_caches
+from src.scripts.scratch_space import scratch
 from src.scripts.video_metadata import VideoMetaData
 
+# links only, so train videos are never materialized
+TRAIN_LINK_METHODS = ("hardlink", "reflink", "symlink")
+
 
 def get_annotation_path(video_path):
     return video_path.replace("/video/", "/ann/") + ".json"
 
 
-def split_project():
-    mkdir(g.SPLIT_PROJECT_DIR, True)
+def link_video(
+    video_metadata: VideoMetaData,
+    item_paths: Optional[ItemPaths],
+    video_dir: str,
+    ann_dir: str,
+    methods: Sequence[str],
+    need_file: bool = True,
+) -> bool:
+    """Put the cached video and its annotation into a split directory without copying
+    if possible. Returns False if the video is already there, not cached or has no annotation.
+    Without need_file, a video cached as annotation only is split as is."""
+    if item_paths is None:
+        return False
+    _, src_video_path, src_ann_path = item_paths
+
+    unique_name = f"{video_metadata.dataset_id}_{video_metadata.name}"
+    dst_video_path = os.path.join(video_dir, unique_name)
+    dst_ann_path = os.path.join(ann_dir, unique_name + ".json")
+    if os.path.exists(dst_ann_path) or not os.path.exists(src_ann_path):
+        return False
+    has_file = os.path.exists(src_video_path)
+    if need_file and not has_file:
+        return False
+
+    if has_file:
+        method = link_or_copy(src_video_path, dst_video_path, methods)
+        if method == "copy":
+            scratch.add("split", dst_video_path)
+    link_or_copy(src_ann_path, dst_ann_path)
+
+    video_metadata.path = dst_video_path
+    video_metadata.set_split_path(dst_video_path)
+    return True
+
+
+def split_project(videos: Optional[Iterable[VideoMetaData]] = None):
+    """Link videos into the train and test directories as they become available.
+
+    videos defaults to g.VIDEOS_TO_UPLOAD, already in the cache; pass
+    download_project.Prefetcher.next_round() to split each video as soon as it is downloaded.
+    """
+    # clips and their manifest from earlier runs are kept, only the split videos are reset
+    mkdir(g.SPLIT_PROJECT_DIR)
 
     train_dir = os.path.join(g.SPLIT_PROJECT_DIR, "train")
     train_video_dir = os.path.join(train_dir, "video")
@@ -33,6 +81,8 @@ def split_project():
     os.makedirs(train_ann_dir, exist_ok=True)
     os.makedirs(test_video_dir, exist_ok=True)
     os.makedirs(test_ann_dir, exist_ok=True)
+    for split_dir in [train_video_dir, train_ann_dir, test_video_dir, test_ann_dir]:
+        clean_dir(split_dir)
 
     src_meta_path = os.path.join(g.CACHED_PROJECT_DIR, "meta.json")
     dst_meta_path = os.path.join(g.SPLIT_PROJECT_DIR, "meta.json")
@@ -40,61 +90,40 @@ def split_project():
         shutil.copy(src_meta_path, dst_meta_path)
     dump_json_file(KeyIdMap().to_dict(), os.path.join(g.SPLIT_PROJECT_DIR, "key_id_map.json"))
 
-    # get videos paths in the project
-    video_paths = {}
-    project = VideoProject(g.CACHED_PROJECT_DIR, OpenMode.READ)
-    for dataset in project.datasets:
-        dataset: VideoDataset
-        for name, video_path, ann_path in dataset.items():
-            video_info = dataset.get_item_info(name)
-            video_paths[video_info.id] = (name, video_path, ann_path)
-
-    train_size = int(len(g.VIDEOS_TO_UPLOAD) * g.SPLIT_RATIO)
-    g.TRAIN_VIDEOS = g.VIDEOS_TO_UPLOAD[:train_size]
-    g.TEST_VIDEOS = g.VIDEOS_TO_UPLOAD[train_size:]
+    # resolve paths of the new videos only, through the persisted id -> path index
+    item_index = ItemIndex(g.CACHED_PROJECT_DIR, g.ITEM_INDEX_PATH)
+    if videos is None:
+        videos = g.VIDEOS_TO_UPLOAD
+
+    g.TRAIN_VIDEOS = []
+    g.TEST_VIDEOS = []
     with g.PROGRESS_BAR(message="Splitting videos", total=len(g.VIDEOS_TO_UPLOAD)) as progress_bar:
         g.PROGRESS_BAR.show()
-        for video_metadata in g.TRAIN_VIDEOS.copy():
-            video_metadata: VideoMetaData
-            _, src_video_path, src_ann_path = video_paths[video_metadata.video_id]
-
-            unique_name = f"{video_metadata.dataset_id}_{video_metadata.name}"
-            dst_video_path = os.path.join(train_video_dir, unique_name)
-            dst_ann_path = os.path.join(train_ann_dir, unique_name + ".json")
-
-            if not os.path.exists(dst_video_path) and os.path.exists(src_ann_path):
-                shutil.copy(src_video_path, dst_video_path)
-                shutil.copy(src_ann_path, dst_ann_path)
-
-                video_metadata.path = dst_video_path
-                video_metadata.set_split_path(dst_video_path)
+        for video_metadata in videos:
+            if is_train_video(video_metadata.video_id, g.SPLIT_RATIO, g.SPLIT_SALT):
+                # clips are cut from the cached file, the train split never needs a copy
+                split_name, split_videos = "train", g.TRAIN_VIDEOS
+                dirs, methods = (train_video_dir, train_ann_dir), TRAIN_LINK_METHODS
+                need_file = True
             else:
-                logger.debug(
-                    f"Video '{video_metadata.name}' already exists in train directory. It was removed from train videos."
-                )
-                g.TRAIN_VIDEOS.remove(video_metadata)
-            progress_bar.update(1)
-
-        for video_metadata in g.TEST_VIDEOS.copy():
-            video_metadata: VideoMetaData
-            _, src_video_path, src_ann_path = video_paths[video_metadata.video_id]
-
-            unique_name = f"{video_metadata.dataset_id}_{video_metadata.name}"
-            dst_video_path = os.path.join(test_video_dir, unique_name)
-            dst_ann_path = os.path.join(test_ann_dir, unique_name + ".json")
-
-            if not os.path.exists(dst_video_path) and os.path.exists(src_ann_path):
-                shutil.copy(src_video_path, dst_video_path)
-                shutil.copy(src_ann_path, dst_ann_path)
-
-                video_metadata.path = dst_video_path
-                video_metadata.set_split_path(dst_video_path)
+                split_name, split_videos = "test", g.TEST_VIDEOS
+                dirs, methods = (test_video_dir, test_ann_dir), LINK_METHODS
+                # test videos with a link or hash on the server are uploaded without the file
+                need_file = video_metadata.get_upload_source() == "path"
+
+            if link_video(
+                video_metadata, item_index.find(video_metadata), *dirs, methods, need_file
+            ):
+                split_videos.append(video_metadata)
+                if split_name == "train":
+                    # probed here, while the next videos are still downloading
+                    warm_probe_caches(video_metadata.split_path)
             else:
                 logger.debug(
-                    f"Video '{video_metadata.name}' already exists in test directory. It was removed from test videos."
+                    f"Video '{video_metadata.name}' already exists in {split_name} directory. It was removed from {split_name} videos."
                 )
-                g.TEST_VIDEOS.remove(video_metadata)
             progress_bar.update(1)
 
+    item_index.save()
     g.PROGRESS_BAR.hide()
     return g.SPLIT_PROJECT_DIR
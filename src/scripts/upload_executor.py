@@ -0,0 +1,120 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from supervisely import logger
+
+
+class AdaptiveBatchSize:
+    """Upload batch size that follows the measured latency and payload of finished batches.
+
+    The size grows while batches finish faster than target_seconds and shrinks when they
+    take longer, by at most a factor of two per batch, and stays under max_bytes.
+    """
+
+    def __init__(
+        self,
+        initial: int = 10,
+        minimum: int = 1,
+        maximum: int = 50,
+        target_seconds: float = 10.0,
+        max_bytes: Optional[int] = None,
+    ):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.item_bytes: Optional[float] = None
+
+    def next(self) -> int:
+        size = self.size
+        if self.max_bytes is not None and self.item_bytes:
+            size = min(size, int(self.max_bytes // self.item_bytes))
+        return max(self.minimum, min(self.maximum, size))
+
+    def record(self, items: int, nbytes: int, seconds: float) -> None:
+        if items == 0:
+            return
+        item_bytes = nbytes / items
+        if self.item_bytes is None:
+            self.item_bytes = item_bytes
+        else:
+            self.item_bytes = 0.7 * self.item_bytes + 0.3 * item_bytes
+        factor = min(2.0, max(0.5, self.target_seconds / max(seconds, 1e-3)))
+        self.size = max(self.minimum, min(self.maximum, round(self.size * factor)))
+        logger.debug(
+            f"Uploaded {items} items ({nbytes} bytes) in {seconds:.1f}s, "
+            f"next batch size: {self.size}"
+        )
+
+
+def payload_size(paths: List[Optional[str]]) -> int:
+    return sum(os.path.getsize(path) for path in paths if path and os.path.exists(path))
+
+
+def _timed(func: Callable, *args):
+    started = time.monotonic()
+    result = func(*args)
+    return result, time.monotonic() - started
+
+
+class UploadExecutor:
+    """Keeps up to `workers` upload batches in flight.
+
+    upload(*args) runs on a worker thread and should only talk to the server; on_done is
+    called on the submitting thread in submission order, so whatever it writes (cache,
+    local mirror) is written in the same order however the uploads interleave.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="upload")
+        self._pending = deque()
+
+    def _in_flight(self) -> int:
+        return sum(1 for future, _ in self._pending if future is not None)
+
+    def submit(self, upload: Callable, args: tuple, on_done: Callable) -> None:
+        """on_done(result, seconds) gets the result of upload(*args) and its duration."""
+        while self._in_flight() >= self.workers:
+            self._finish_next()
+        future = self._executor.submit(_timed, upload, *args)
+        self._pending.append((future, on_done))
+
+    def then(self, callback: Callable[[], None]) -> None:
+        """Call callback() once every batch submitted so far is done, in submission order."""
+        self._pending.append((None, callback))
+        self.poll()
+
+    def poll(self) -> None:
+        """Handle the results that are ready without waiting for the others."""
+        while self._pending and (self._pending[0][0] is None or self._pending[0][0].done()):
+            self._finish_next()
+
+    def _finish_next(self) -> None:
+        future, on_done = self._pending.popleft()
+        if future is None:
+            on_done()
+            return
+        result, seconds = future.result()
+        on_done(result, seconds)
+
+    def drain(self) -> None:
+        while self._pending:
+            self._finish_next()
+
+    def shutdown(self) -> None:
+        """Wait for batches in flight without handling their results, used on errors."""
+        self._executor.shutdown(wait=True)
+        self._pending.clear()
+
+    def __enter__(self) -> "UploadExecutor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.drain()
+        self.shutdown()
@@ -1,14 +1,21 @@
 import os
-from typing import List
+from dataclasses import asdict, dataclass
+from queue import Empty, Queue
+from threading import Thread
+from typing import Callable, Dict, List, Optional
 
 import src.globals as g
-from src.scripts.cache import add_single_clip_to_cache, add_video_to_cache, upload_cache
+from src.scripts.cache import add_clip_batch_to_cache, add_video_to_cache, upload_cache
+from src.scripts.dst_index import dst_index
+from src.scripts.make_training_clips import make_training_clips
+from src.scripts.scratch_space import scratch
+from src.scripts.upload_executor import AdaptiveBatchSize, UploadExecutor, payload_size
 from src.scripts.video_metadata import VideoMetaData
-from supervisely import batched, logger
+from supervisely import logger
+from supervisely.api.dataset_api import DatasetInfo
 from supervisely.api.video.video_api import VideoInfo
-from supervisely.io.fs import clean_dir
-from supervisely.project.project import OpenMode
-from supervisely.project.video_project import VideoDataset, VideoProject
+from supervisely.io.fs import get_file_hash
+from supervisely.project.video_project import VideoDataset
 from supervisely.video_annotation.video_annotation import VideoAnnotation
 
 
@@ -18,6 +25,9 @@ def validate_batch(batch: List[VideoInfo], is_test: bool, pbar) -> List[VideoMet
         video_path = video_metadata.path
         if is_test:
             video_path = video_metadata.split_path
+            if video_metadata.get_upload_source() != "path":
+                # uploaded by link or hash, the file is not downloaded
+                video_path = video_metadata.split_ann_path
         if not os.path.exists(video_path):
             logger.debug(f"Video file not found: {video_path}")
             add_video_to_cache(video_metadata, is_uploaded=False, is_detected=False, upload=False)
@@ -32,224 +42,497 @@ def move_empty_videos_to_test_set(training_videos: dict, all_clips: dict):
     if len(empty_videos) == 0:
         return
     logger.info(f"Found {len(empty_videos)} videos with no clips")
-    for video_id in empty_videos:
-        g.TRAIN_VIDEOS.remove(training_videos[video_id])
-        g.TEST_VIDEOS.append(training_videos[video_id])
+    g.TRAIN_VIDEOS = [video for video in g.TRAIN_VIDEOS if video.video_id not in empty_videos]
+    g.TEST_VIDEOS.extend(training_videos[video_id] for video_id in empty_videos)
     logger.info(f"Moved {len(empty_videos)} videos with no clips to test set")
 
 
-def get_or_create_dataset_fs(project: VideoProject, dataset_name: str, parent_path: str = ""):
-    if parent_path != "":
-        ds_path = os.path.join(parent_path, VideoDataset.datasets_dir_name, dataset_name)
-    else:
-        ds_path = dataset_name
-    for dataset in project.datasets:
-        dataset: VideoDataset
-        if dataset.path == ds_path:
-            return dataset
-    return project.create_dataset(dataset_name, ds_path)
+def get_mirror_path(path: str) -> Optional[str]:
+    """Path of the file to keep in the destination mirror, None for annotation only."""
+    if g.MIRROR_DST_VIDEO_FILES and os.path.exists(path):
+        return path
+    return None
+
+
+def get_or_create_dst_dataset(name: str, parent_id: Optional[int] = None):
+    """Dataset of the destination project and of its local mirror, recorded in the index."""
+    dataset = g.API.dataset.get_or_create(g.DST_PROJECT_ID, name, parent_id=parent_id)
+    dst_index.add_dataset(dataset)
+    return dataset, dst_index.get_dataset_fs(dataset.id)
+
+
+def upload_test_batch(batch: List[VideoMetaData], dataset_id: int) -> List[VideoInfo]:
+    """Upload by link or hash where the source has one, from the local file otherwise.
+    Returns the infos in the order of the batch."""
+    by_source: Dict[str, List[int]] = {}
+    for i, video_metadata in enumerate(batch):
+        by_source.setdefault(video_metadata.get_upload_source(), []).append(i)
+
+    uploaded: List[Optional[VideoInfo]] = [None] * len(batch)
+    for source, indices in by_source.items():
+        videos = [batch[i] for i in indices]
+        names = [video_metadata.name for video_metadata in videos]
+        if source == "link":
+            links = [video_metadata.source_video_info.link for video_metadata in videos]
+            infos = g.API.video.upload_links(dataset_id=dataset_id, links=links, names=names)
+        elif source == "hash":
+            hashes = [video_metadata.source_video_info.hash for video_metadata in videos]
+            infos = g.API.video.upload_hashes(dataset_id=dataset_id, hashes=hashes, names=names)
+        else:
+            paths = [video_metadata.split_path for video_metadata in videos]
+            infos = g.API.video.upload_paths(dataset_id=dataset_id, names=names, paths=paths)
+        for i, video_info in zip(indices, infos):
+            uploaded[i] = video_info
+    return uploaded
+
+
+def get_batch_size() -> AdaptiveBatchSize:
+    return AdaptiveBatchSize(
+        initial=g.UPLOAD_BATCH_SIZE,
+        maximum=g.UPLOAD_MAX_BATCH_SIZE,
+        target_seconds=g.UPLOAD_TARGET_BATCH_SECONDS,
+        max_bytes=g.UPLOAD_MAX_BATCH_MB * 1024**2,
+    )
+
+
+def submit_batches(
+    executor: UploadExecutor,
+    batch_size: AdaptiveBatchSize,
+    items: List[VideoMetaData],
+    upload: Callable,
+    finish: Callable,
+    get_path: Callable[[VideoMetaData], Optional[str]],
+) -> None:
+    """Submit items in batches sized from the batches finished so far.
+
+    upload(batch) runs on an upload thread; finish(batch, result) runs in submission order.
+    """
+    start = 0
+    while start < len(items):
+        batch = items[start : start + batch_size.next()]
+        start += len(batch)
+        nbytes = payload_size([get_path(item) for item in batch])
+
+        def on_done(result, seconds, batch=batch, nbytes=nbytes):
+            batch_size.record(len(batch), nbytes, seconds)
+            finish(batch, result)
+
+        executor.submit(upload, (batch,), on_done)
 
 
 def upload_test_videos() -> List[VideoInfo]:
     if not g.TEST_VIDEOS:
         return
 
-    try:
-        project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.READ)
-    except RuntimeError as e:
-        if "Project is empty" in str(e):
-            clean_dir(g.DST_PROJECT_PATH)
-            project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.CREATE)
-            project_fs.set_meta(g.DST_PROJECT_META)
-        else:
-            raise e
-    test_dataset_fs = get_or_create_dataset_fs(project_fs, "test")
-
     logger.info(f"Uploading {len(g.TEST_VIDEOS)} test videos")
-    test_dataset = g.API.dataset.get_or_create(g.DST_PROJECT_ID, "test")
-    with g.PROGRESS_BAR(message=f"Uploading test videos", total=len(g.TEST_VIDEOS)) as pbar:
-        g.PROGRESS_BAR.show()
-        for video_metadata_batch in batched(g.TEST_VIDEOS, 10):
-            validated_batch = validate_batch(video_metadata_batch, True, pbar)
-            video_names = [video_metadata.name for video_metadata in validated_batch]
-            video_links = [
-                video_metadata.source_video_info.link for video_metadata in validated_batch
-            ]
-            video_hashes = [
-                video_metadata.source_video_info.hash for video_metadata in validated_batch
-            ]
-            video_paths = [video_metadata.split_path for video_metadata in validated_batch]
-            video_ann_paths = [video_metadata.split_ann_path for video_metadata in validated_batch]
-
-            has_links = all(
-                video_metadata.source_video_info.link for video_metadata in validated_batch
-            )
-            has_hashes = all(
-                video_metadata.source_video_info.hash for video_metadata in validated_batch
+    test_dataset, test_dataset_fs = get_or_create_dst_dataset("test")
+
+    def upload(batch: List[VideoMetaData]) -> List[VideoInfo]:
+        uploaded_batch = upload_test_batch(batch, test_dataset.id)
+        logger.debug(f"Uploading {len(batch)} video annotations")
+        g.API.video.annotation.upload_paths(
+            video_ids=[video_info.id for video_info in uploaded_batch],
+            ann_paths=[video_metadata.split_ann_path for video_metadata in batch],
+            project_meta=g.PROJECT_META,
+        )
+        logger.debug("Done uploading video annotations")
+        return uploaded_batch
+
+    def finish(batch: List[VideoMetaData], uploaded_batch: List[VideoInfo]) -> None:
+        for video_metadata, video_info in zip(batch, uploaded_batch):
+            video_name, video_path = video_metadata.name, video_metadata.split_path
+            if test_dataset_fs.item_exists(video_name):
+                test_dataset_fs.delete_item(video_name)
+            test_dataset_fs.add_item_file(
+                video_name,
+                get_mirror_path(video_path),
+                ann=VideoAnnotation(
+                    (video_info.frame_height, video_info.frame_width), video_info.frames_count
+                ),
+                item_info=video_info,
+                _use_hardlink=True,
             )
+            scratch.release(video_path)
+            if video_metadata.download_path is not None:
+                scratch.release(video_metadata.download_path)
+            dst_index.add(video_info)
+
+            video_metadata.is_test = True
+            video_metadata.train_data_id = video_info.id
+            add_video_to_cache(video_metadata, is_uploaded=True, is_detected=False, upload=False)
+        upload_cache()
+        g.VIDEOS_TO_DETECT.extend(uploaded_batch)
+        pbar.update(len(batch))
+
+    def get_path(video_metadata: VideoMetaData) -> Optional[str]:
+        # links and hashes send no video bytes
+        if video_metadata.get_upload_source() == "path":
+            return video_metadata.split_path
+        return None
 
-            if has_links:
-                uploaded_batch = g.API.video.upload_links(
-                    dataset_id=test_dataset.id,
-                    links=video_links,
-                    names=video_names,
-                )
-            elif has_hashes:
-                uploaded_batch = g.API.video.upload_hashes(
-                    dataset_id=test_dataset.id,
-                    hashes=video_hashes,
-                    names=video_names,
-                )
-            else:
-                uploaded_batch = g.API.video.upload_paths(
-                    dataset_id=test_dataset.id,
-                    names=video_names,
-                    paths=video_paths,
-                )
-
-            logger.debug(f"Uploading {len(video_ann_paths)} video annotations")
-            video_ids = [video_info.id for video_info in uploaded_batch]
-            g.API.video.annotation.upload_paths(
-                video_ids=video_ids,
-                ann_paths=video_ann_paths,
-                project_meta=g.PROJECT_META,
-            )
-            logger.debug("Done uploading video annotations")
-
-            for video_name, video_path, video_info in zip(video_names, video_paths, uploaded_batch):
-                if test_dataset_fs.item_exists(video_name):
-                    test_dataset_fs.delete_item(video_name)
-                test_dataset_fs.add_item_file(
-                    video_name,
-                    video_path,
-                    ann=VideoAnnotation(
-                        (video_info.frame_height, video_info.frame_width), video_info.frames_count
-                    ),
-                    item_info=video_info,
-                )
-
-            for i, video_metadata in enumerate(validated_batch):
-                video_metadata.is_test = True
-                video_metadata.train_data_id = uploaded_batch[i].id
-                add_video_to_cache(
-                    video_metadata, is_uploaded=True, is_detected=False, upload=False
-                )
-            upload_cache()
-            g.VIDEOS_TO_DETECT.extend(uploaded_batch)
-            pbar.update(len(validated_batch))
+    with g.PROGRESS_BAR(message=f"Uploading test videos", total=len(g.TEST_VIDEOS)) as pbar:
+        g.PROGRESS_BAR.show()
+        validated = validate_batch(g.TEST_VIDEOS, True, pbar)
+        with UploadExecutor(g.UPLOAD_WORKERS) as executor:
+            submit_batches(executor, get_batch_size(), validated, upload, finish, get_path)
         g.PROGRESS_BAR.hide()
     logger.info(f"{len(g.TEST_VIDEOS)} test videos were uploaded")
 
 
-def upload_train_videos() -> List[VideoInfo]:
-    if not g.TRAIN_VIDEOS:
-        return
+@dataclass
+class TrainDatasets:
+    label_datasets: Dict[str, DatasetInfo]
+    label_datasets_fs: Dict[str, VideoDataset]
 
-    try:
-        project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.READ)
-    except RuntimeError as e:
-        if "Project is empty" in str(e):
-            clean_dir(g.DST_PROJECT_PATH)
-            project_fs = VideoProject(g.DST_PROJECT_PATH, OpenMode.CREATE)
-            project_fs.set_meta(g.DST_PROJECT_META)
-        else:
-            raise e
-    train_dataset_fs = get_or_create_dataset_fs(project_fs, "train")
 
+def get_train_datasets() -> TrainDatasets:
+    train_dataset, _ = get_or_create_dst_dataset("train")
+
+    label_datasets = {}
     label_datasets_fs = {}
     for label in g.CLIP_LABELS:
-        label_datasets_fs[label] = get_or_create_dataset_fs(
-            project_fs, label, train_dataset_fs.path
+        label_datasets[label], label_datasets_fs[label] = get_or_create_dst_dataset(
+            label, parent_id=train_dataset.id
         )
+    return TrainDatasets(label_datasets, label_datasets_fs)
 
-    logger.info(f"Uploading clips for {len(g.TRAIN_VIDEOS)} training videos")
-    train_dataset = g.API.dataset.get_or_create(g.DST_PROJECT_ID, "train")
-    label_datasets = {}
-    for label in g.CLIP_LABELS:
-        label_dataset = g.API.dataset.get_or_create(
-            g.DST_PROJECT_ID, label, parent_id=train_dataset.id
+
+def group_clips(clips: List[VideoMetaData]) -> Dict[int, Dict[str, List[VideoMetaData]]]:
+    """Source video id -> label -> clips, in the order the clips were made."""
+    grouped = {}
+    for clip_metadata in clips:
+        src_vid_id = clip_metadata.source_video.video_id
+        grouped.setdefault(src_vid_id, {}).setdefault(clip_metadata.label, []).append(clip_metadata)
+    return grouped
+
+
+def get_clip_name(clip_metadata: VideoMetaData) -> str:
+    return f"{clip_metadata.source_video.video_id}_{clip_metadata.name}"
+
+
+@dataclass
+class ClipBatchResult:
+    infos: List[VideoInfo]
+    # clips whose content was already on the server, uploaded by hash
+    reused: int = 0
+    bytes_sent: int = 0
+    bytes_saved: int = 0
+
+
+@dataclass
+class UploadStats:
+    clips: int = 0
+    reused: int = 0
+    bytes_sent: int = 0
+    bytes_saved: int = 0
+
+    def add(self, result: ClipBatchResult) -> None:
+        self.clips += len(result.infos)
+        self.reused += result.reused
+        self.bytes_sent += result.bytes_sent
+        self.bytes_saved += result.bytes_saved
+
+    def log(self) -> None:
+        logger.info(
+            f"Uploaded {self.clips} clips, {self.reused} of them by hash of content already "
+            f"on the server: {self.bytes_sent} bytes sent, {self.bytes_saved} bytes saved",
+            extra=asdict(self),
         )
-        label_datasets[label] = label_dataset
+
+
+upload_stats = UploadStats()
+
+
+def upload_clip_batch(
+    clips: List[VideoMetaData], label: str, datasets: TrainDatasets
+) -> ClipBatchResult:
+    """Upload a batch of clips, by hash for content the server already stores."""
+    dataset_id = datasets.label_datasets[label].id
+    names = [get_clip_name(clip_metadata) for clip_metadata in clips]
+    paths = [clip_metadata.path for clip_metadata in clips]
+    sizes = [os.path.getsize(path) for path in paths]
+    if not g.DEDUPE_CLIP_UPLOADS:
+        infos = g.API.video.upload_paths(dataset_id=dataset_id, names=names, paths=paths)
+        return ClipBatchResult(infos, bytes_sent=sum(sizes))
+
+    hashes = [get_file_hash(path) for path in paths]
+    existing = set(g.API.video.check_existing_hashes(list(set(hashes))))
+    known = [i for i, clip_hash in enumerate(hashes) if clip_hash in existing]
+    unknown = [i for i, clip_hash in enumerate(hashes) if clip_hash not in existing]
+
+    infos: List[Optional[VideoInfo]] = [None] * len(clips)
+    if known:
+        uploaded = g.API.video.upload_hashes(
+            dataset_id=dataset_id,
+            names=[names[i] for i in known],
+            hashes=[hashes[i] for i in known],
+        )
+        for i, video_info in zip(known, uploaded):
+            infos[i] = video_info
+    if unknown:
+        uploaded = g.API.video.upload_paths(
+            dataset_id=dataset_id,
+            names=[names[i] for i in unknown],
+            paths=[paths[i] for i in unknown],
+        )
+        for i, video_info in zip(unknown, uploaded):
+            infos[i] = video_info
+    return ClipBatchResult(
+        infos,
+        reused=len(known),
+        bytes_sent=sum(sizes[i] for i in unknown),
+        bytes_saved=sum(sizes[i] for i in known),
+    )
+
+
+def finish_clip_batch(
+    clips: List[VideoMetaData],
+    result: ClipBatchResult,
+    label: str,
+    datasets: TrainDatasets,
+    pbar,
+) -> None:
+    upload_stats.add(result)
+    uploaded_batch = result.infos
+    label_dataset_fs = datasets.label_datasets_fs[label]
+    for clip_metadata, clip_info in zip(clips, uploaded_batch):
+        clip_name, clip_path = get_clip_name(clip_metadata), clip_metadata.path
+        if label_dataset_fs.item_exists(clip_name):
+            label_dataset_fs.delete_item(clip_name)
+        # hardlinked if files are mirrored, the clip is released right after the upload;
+        # kept clips are reused by later runs and keep counting toward the scratch budget
+        label_dataset_fs.add_item_file(
+            clip_name,
+            get_mirror_path(clip_path),
+            ann=VideoAnnotation(
+                (clip_info.frame_height, clip_info.frame_width),
+                clip_info.frames_count,
+            ),
+            item_info=clip_info,
+            _use_hardlink=True,
+        )
+        if g.DELETE_UPLOADED_CLIPS:
+            scratch.release(clip_path, delete=True)
+        dst_index.add(clip_info)
+
+        clip_metadata.clip_id = clip_info.id
+        clip_metadata.train_data_id = clip_info.id
+    add_clip_batch_to_cache(clips[: len(uploaded_batch)])
+
+    pbar.update(len(clips))
+    g.VIDEOS_TO_DETECT.extend(uploaded_batch)
+
+
+def submit_video_clips(
+    executor: UploadExecutor,
+    batch_size: AdaptiveBatchSize,
+    clips_by_label: Dict[str, List[VideoMetaData]],
+    datasets: TrainDatasets,
+    pbar,
+) -> None:
+    """Submit the clips of one source video; batches of all labels share the executor."""
+    for label, clips in clips_by_label.items():
+        validated = validate_batch(clips, False, pbar)
+        submit_batches(
+            executor,
+            batch_size,
+            validated,
+            lambda batch, label=label: upload_clip_batch(batch, label, datasets),
+            lambda batch, result, label=label: finish_clip_batch(
+                batch, result, label, datasets, pbar
+            ),
+            lambda clip_metadata: clip_metadata.path,
+        )
+
+
+def upload_train_videos() -> List[VideoInfo]:
+    if not g.TRAIN_VIDEOS:
+        return
+
+    logger.info(f"Uploading clips for {len(g.TRAIN_VIDEOS)} training videos")
+    datasets = get_train_datasets()
 
     training_videos = {}
     for video_metadata in g.TRAIN_VIDEOS:
         training_videos[video_metadata.video_id] = video_metadata
 
-    all_clips = {}
-    for video_metadata in g.TRAIN_VIDEOS:
-        for clip_metadata in video_metadata.clips:
-            src_vid_id = (
-                clip_metadata.source_video.video_id
-                if isinstance(clip_metadata.source_video, object)
-                else None
-            )
-            if src_vid_id not in all_clips:
-                all_clips[src_vid_id] = {}
-            if clip_metadata.label not in all_clips[src_vid_id]:
-                all_clips[src_vid_id][clip_metadata.label] = []
-            all_clips[src_vid_id][clip_metadata.label].append(clip_metadata)
+    all_clips = group_clips(
+        [
+            clip_metadata
+            for video_metadata in g.TRAIN_VIDEOS
+            for clip_metadata in video_metadata.clips
+        ]
+    )
 
     move_empty_videos_to_test_set(training_videos, all_clips)
 
     if len(all_clips) > 0:
+        total_clips = sum(
+            len(clips) for by_label in all_clips.values() for clips in by_label.values()
+        )
         with g.PROGRESS_BAR(
             message=f"Uploading training videos", total=len(all_clips.keys())
-        ) as pbar:
+        ) as pbar, g.PROGRESS_BAR_2(message="Uploading clips", total=total_clips) as pbar_2:
             g.PROGRESS_BAR.show()
-            for src_vid_id in all_clips.keys():
-                for label in all_clips[src_vid_id].keys():
-                    clips = all_clips[src_vid_id][label]
-                    with g.PROGRESS_BAR_2(
-                        message=f"Uploading '{label}' clips for video id: {src_vid_id}",
-                        total=len(clips),
-                    ) as pbar_2:
-                        g.PROGRESS_BAR_2.show()
-                        for clips_batch in batched(clips, 10):
-                            validated_batch = validate_batch(clips_batch, False, pbar_2)
-                            clip_names = [
-                                f"{clip_metadata.source_video.video_id}_{clip_metadata.name}"
-                                for clip_metadata in validated_batch
-                            ]
-                            clip_paths = [clip_metadata.path for clip_metadata in validated_batch]
-                            uploaded_batch = g.API.video.upload_paths(
-                                dataset_id=label_datasets[label].id,
-                                names=clip_names,
-                                paths=clip_paths,
-                            )
-
-                            for clip_name, clip_path, clip_info in zip(
-                                clip_names, clip_paths, uploaded_batch
-                            ):
-                                if label_datasets_fs[label].item_exists(clip_name):
-                                    label_datasets_fs[label].delete_item(clip_name)
-                                label_datasets_fs[label].add_item_file(
-                                    clip_name,
-                                    clip_path,
-                                    ann=VideoAnnotation(
-                                        (clip_info.frame_height, clip_info.frame_width),
-                                        clip_info.frames_count,
-                                    ),
-                                    item_info=clip_info,
-                                )
-
-                            for clip_metadata, uploaded_clip in zip(
-                                validated_batch, uploaded_batch
-                            ):
-                                clip_metadata.clip_id = uploaded_clip.id
-                                clip_metadata.train_data_id = uploaded_clip.id
-                                add_single_clip_to_cache(clip_metadata)
-
-                            pbar_2.update(len(validated_batch))
-                            g.VIDEOS_TO_DETECT.extend(uploaded_batch)
-
-                add_video_to_cache(training_videos[src_vid_id], is_uploaded=True, is_detected=False)
-                pbar.update(1)
+            g.PROGRESS_BAR_2.show()
+            batch_size = get_batch_size()
+            with UploadExecutor(g.UPLOAD_WORKERS) as executor:
+                for src_vid_id, clips_by_label in all_clips.items():
+                    submit_video_clips(executor, batch_size, clips_by_label, datasets, pbar_2)
+
+                    def video_done(src_vid_id=src_vid_id):
+                        add_video_to_cache(
+                            training_videos[src_vid_id], is_uploaded=True, is_detected=False
+                        )
+                        pbar.update(1)
+
+                    executor.then(video_done)
 
     g.PROGRESS_BAR_2.hide()
     g.PROGRESS_BAR.hide()
     logger.info(f"Training clips for {len(g.TRAIN_VIDEOS)} videos were uploaded")
 
 
-def upload_project() -> List[VideoInfo]:
-    upload_train_videos()
+class ClipUploader:
+    """Uploads clip batches from a background thread while the main thread keeps encoding.
+
+    The queue is bounded, so put() blocks once encoding gets UPLOAD_QUEUE_SIZE batches ahead.
+    Batches of consecutive videos overlap on the upload executor.
+    """
+
+    _STOP = object()
+
+    def __init__(self, datasets: TrainDatasets, queue_size: int):
+        self.datasets = datasets
+        self.queue = Queue(maxsize=max(1, queue_size))
+        # in upload order
+        self.uploaded_videos = []
+        self.error: Optional[BaseException] = None
+        self._consuming = False
+        self._thread = Thread(target=self._run, name="clip-uploader", daemon=True)
+
+    def start(self) -> None:
+        # uploaded clips are released from this thread, clip making may wait for them
+        scratch.start_consumer()
+        self._consuming = True
+        self._thread.start()
+
+    def _stop_consuming(self) -> None:
+        if self._consuming:
+            self._consuming = False
+            scratch.stop_consumer()
+
+    def _fail(self, executor: UploadExecutor, e: BaseException) -> None:
+        logger.error(f"Error uploading clips: {str(e)}")
+        self.error = e
+        executor.shutdown()
+        # nothing is released anymore, clip making must not wait for it
+        self._stop_consuming()
+
+    def _run(self) -> None:
+        executor = UploadExecutor(g.UPLOAD_WORKERS)
+        batch_size = get_batch_size()
+        with g.PROGRESS_BAR_2(message="Uploading clips", total=0) as pbar:
+            g.PROGRESS_BAR_2.show()
+            while True:
+                try:
+                    clips = self.queue.get(timeout=1)
+                except Empty:
+                    # finished batches release their clips, clip making may be waiting for space
+                    if self.error is None:
+                        try:
+                            executor.poll()
+                        except BaseException as e:
+                            self._fail(executor, e)
+                    continue
+                if clips is self._STOP:
+                    break
+                if self.error is not None:
+                    continue  # drain the queue so the producer never blocks on a dead uploader
+                try:
+                    # clips of the next videos are submitted while earlier batches are in flight
+                    pbar.total += len(clips)
+                    pbar.refresh()
+                    for src_vid_id, clips_by_label in group_clips(clips).items():
+                        submit_video_clips(
+                            executor, batch_size, clips_by_label, self.datasets, pbar
+                        )
+                        executor.then(
+                            lambda src_vid_id=src_vid_id: self.uploaded_videos.append(src_vid_id)
+                        )
+                except BaseException as e:
+                    self._fail(executor, e)
+            if self.error is None:
+                try:
+                    executor.drain()
+                except BaseException as e:
+                    self._fail(executor, e)
+        executor.shutdown()
+        self._stop_consuming()
+
+    def put(self, clips: List[VideoMetaData]) -> None:
+        if self.error is not None:
+            raise RuntimeError("Clip upload failed") from self.error
+        if clips:
+            self.queue.put(clips)
+
+    def stop(self) -> None:
+        """Drop batches not uploaded yet, used when clip making fails."""
+        if self.error is None:
+            self.error = RuntimeError("Clip making failed")
+        self.queue.put(self._STOP)
+        self._thread.join()
+
+    def join(self) -> None:
+        self.queue.put(self._STOP)
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError("Clip upload failed") from self.error
+
+
+def stream_train_videos(require_positives: bool = True) -> None:
+    """Make training clips and upload every finished batch while the next one is encoded."""
+    if not g.TRAIN_VIDEOS:
+        make_training_clips(require_positives=require_positives)
+        return
+
+    logger.info(f"Making and uploading clips for {len(g.TRAIN_VIDEOS)} training videos")
+    uploader = ClipUploader(get_train_datasets(), g.UPLOAD_QUEUE_SIZE)
+    uploader.start()
+    try:
+        make_training_clips(on_clips=uploader.put, require_positives=require_positives)
+    except BaseException:
+        uploader.stop()
+        raise
+    uploader.join()
+
+    training_videos = {}
+    for video_metadata in g.TRAIN_VIDEOS:
+        training_videos[video_metadata.video_id] = video_metadata
+    move_empty_videos_to_test_set(training_videos, dict.fromkeys(uploader.uploaded_videos))
+    for src_vid_id in uploader.uploaded_videos:
+        add_video_to_cache(
+            training_videos[src_vid_id], is_uploaded=True, is_detected=False, upload=False
+        )
+    upload_cache()
+
+    g.PROGRESS_BAR_2.hide()
+    logger.info(f"Training clips for {len(uploader.uploaded_videos)} videos were uploaded")
+
+
+def make_and_upload_project(require_positives: bool = True) -> None:
+    """Make training clips and upload the project, streaming clips if STREAM_UPLOADS is set.
+
+    Without require_positives, videos without positive clips are uploaded as test videos
+    instead of failing the run.
+    """
+    if g.DRY_RUN:
+        make_training_clips(dry_run=True)
+        return
+    if g.STREAM_UPLOADS:
+        stream_train_videos(require_positives)
+    else:
+        make_training_clips(require_positives=require_positives)
+        upload_train_videos()
+    upload_stats.log()
     upload_test_videos()
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from supervisely import logger
+from supervisely.io.fs import get_file_hash_chunked, silent_remove
+
+import src.globals as g
+
+PART_SUFFIX = ".part"
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+@dataclass
+class DownloadTask:
+    video_id: int
+    path: str
+    # expected content, checked when known
+    size: Optional[int] = None
+    hash: Optional[str] = None
+
+
+@dataclass
+class DownloadResult:
+    task: DownloadTask
+    bytes_received: int
+    seconds: float
+    resumed_from: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second of this transfer."""
+        return self.bytes_received / self.seconds if self.seconds > 0 else 0.0
+
+
+def make_session(workers: int) -> requests.Session:
+    """Session with a connection pool shared by all download threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(g.API.headers)
+    return session
+
+
+def get_download_url() -> str:
+    return f"{g.API.api_server_address}/v3/videos.download"
+
+
+def _total_size(response: requests.Response, offset: int) -> Optional[int]:
+    match = CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+    if match is not None and match.group(3) != "*":
+        return int(match.group(3))
+    length = response.headers.get("Content-Length")
+    if length is None:
+        return None
+    return int(length) + (offset if response.status_code == 206 else 0)
+
+
+def _verify(task: DownloadTask, part_path: str, total_size: Optional[int]) -> None:
+    size = os.path.getsize(part_path)
+    expected_size = task.size or total_size
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"Downloaded {size} of {expected_size} bytes of video {task.video_id}")
+    if task.hash and g.VERIFY_DOWNLOAD_HASH and get_file_hash_chunked(part_path) != task.hash:
+        # a corrupt partial file must not be resumed again
+        silent_remove(part_path)
+        raise IOError(f"Hash mismatch of downloaded video {task.video_id}")
+
+
+def _download(session: requests.Session, task: DownloadTask, chunk_size: int) -> DownloadResult:
+    part_path = task.path + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    started = time.monotonic()
+    received = 0
+    with session.post(
+        get_download_url(), json={"id": task.video_id}, headers=headers, stream=True
+    ) as response:
+        if response.status_code == 416 and offset > 0:
+            # the partial file is already complete
+            total_size = offset
+        else:
+            response.raise_for_status()
+            if offset > 0 and response.status_code != 206:
+                logger.debug(f"Range not supported for video {task.video_id}, restarting")
+                offset = 0
+            total_size = _total_size(response, offset)
+            with open(part_path, "ab" if offset > 0 else "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    received += len(chunk)
+
+    _verify(task, part_path, total_size)
+    os.replace(part_path, task.path)
+    return DownloadResult(task, received, time.monotonic() - started, offset)
+
+
+def download_file(
+    session: requests.Session, task: DownloadTask, chunk_size: int, retries: int = 3
+) -> DownloadResult:
+    """Download one video to task.path through a .part file that later attempts,
+    in this run or the next one, continue with a range request."""
+    for attempt in range(retries + 1):
+        try:
+            return _download(session, task, chunk_size)
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            logger.warning(
+                f"Download of video {task.video_id} failed, resuming "
+                f"(attempt {attempt + 1} of {retries}): {str(e)}"
+            )
+            time.sleep(2**attempt)
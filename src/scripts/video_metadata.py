@@ -10,6 +10,8 @@ class VideoMetaData:
         self.path = path
         self.split_path = None
         self.split_ann_path = None
+        # file downloaded to the cache in this run, released once the video is processed
+        self.download_path = None
         self.is_detected = False
         self.train_data_id = None
 
@@ -70,3 +72,13 @@ class VideoMetaData:
     def set_split_path(self, split_path):
         self.split_path = split_path
         self.split_ann_path = split_path.replace("/video/", "/ann/") + ".json"
+
+    def get_upload_source(self) -> str:
+        """How the source video can be uploaded to another project: "link", "hash" or "path".
+        Only "path" needs the video file on disk."""
+        if self.source_video_info is not None:
+            if self.source_video_info.link:
+                return "link"
+            if self.source_video_info.hash:
+                return "hash"
+        return "path"
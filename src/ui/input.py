@@ -4,6 +4,7 @@ from supervisely.project.download import is_cached
 
 import src.globals as g
 from src.scripts.cache import download_cache
+from src.scripts.dst_index import dst_index
 from src.scripts.video_metadata import VideoMetaData
 from src.ui.base_step import BaseStep
 
@@ -55,7 +56,6 @@ class InputStep(BaseStep):
         total_datasets = len(source_datasets) + len(target_datasets)
 
         source_videos = {}
-        target_videos_by_id = {}
         with g.PROGRESS_BAR_PROJECT(message="Fetching Datasets", total=total_datasets) as pbar:
             g.PROGRESS_BAR_PROJECT.show()
             for ds in source_datasets:
@@ -68,11 +68,8 @@ class InputStep(BaseStep):
                     }
                 pbar.update(1)
 
-            for ds in target_datasets:
-                vids = g.API.video.get_list(ds.id)
-                for v in vids:
-                    target_videos_by_id[str(v.id)] = v
-                pbar.update(1)
+            # the destination is listed once per run, later stages use and update this index
+            dst_index.build(target_datasets, pbar.update)
         g.PROGRESS_BAR_PROJECT.hide()
 
         g.VIDEOS_TO_UPLOAD = []
@@ -102,8 +99,8 @@ class InputStep(BaseStep):
                     g.VIDEOS_TO_UPLOAD.append(vm)
                 elif not cache_entry.get("is_detected", False):
                     target_id = cache_entry.get("train_data_id")
-                    if target_id and str(target_id) in target_videos_by_id:
-                        g.VIDEOS_TO_DETECT.append(target_videos_by_id[str(target_id)])
+                    if target_id and dst_index.get(target_id) is not None:
+                        g.VIDEOS_TO_DETECT.append(dst_index.get(target_id).info)
 
         for target_id, map_info in target_map.items():
             source_video_id = map_info["source_video_id"]
@@ -116,12 +113,12 @@ class InputStep(BaseStep):
                     ) and not videos_cache[source_video_id]["clips"][clip_id].get(
                         "is_detected", False
                     ):
-                        if target_id in target_videos_by_id:
-                            g.VIDEOS_TO_DETECT.append(target_videos_by_id[target_id])
+                        if dst_index.get(target_id) is not None:
+                            g.VIDEOS_TO_DETECT.append(dst_index.get(target_id).info)
                 else:
                     if not videos_cache[source_video_id].get("is_detected", False):
-                        if target_id in target_videos_by_id:
-                            g.VIDEOS_TO_DETECT.append(target_videos_by_id[target_id])
+                        if dst_index.get(target_id) is not None:
+                            g.VIDEOS_TO_DETECT.append(dst_index.get(target_id).info)
 
         unique_ids = set()
         unique_detect_list = []
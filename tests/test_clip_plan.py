@@ -0,0 +1,35 @@
+from src.scripts.clip_plan import ClipPlan, PlannedClip, diff_plans, load_plan, save_plan
+
+
+def make_clip(orig_file: str, start: int, end: int, tag: str = "idle") -> PlannedClip:
+    name = f"{orig_file.rsplit('/', 1)[-1]}_{start}.mp4"
+    return PlannedClip(orig_file, f"/clips/{name}", tag, 0, start, end, 640, 480)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    plan = ClipPlan(seed=3, target_length=120, clips=[make_clip("/a/v1.mp4", 0, 9)])
+    path = str(tmp_path / "plans" / "plan.json")
+    save_plan(plan, path)
+    assert load_plan(path) == plan
+
+
+def test_load_missing_or_broken_plan(tmp_path):
+    assert load_plan(str(tmp_path / "missing.json")) is None
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    assert load_plan(str(broken)) is None
+
+
+def test_diff_plans():
+    kept = make_clip("/a/v1.mp4", 0, 9)
+    removed = make_clip("/a/v1.mp4", 20, 29)
+    added = make_clip("/a/v2.mp4", 0, 9)
+    old = ClipPlan(seed=0, target_length=10, clips=[kept, removed])
+    new = ClipPlan(seed=0, target_length=10, clips=[kept, added])
+    assert diff_plans(old, new) == ([added], [removed])
+
+
+def test_diff_plans_compares_sources_by_name():
+    old = ClipPlan(seed=0, target_length=10, clips=[make_clip("/run1/train/v1.mp4", 0, 9)])
+    new = ClipPlan(seed=0, target_length=10, clips=[make_clip("/run2/train/v1.mp4", 0, 9)])
+    assert diff_plans(old, new) == ([], [])
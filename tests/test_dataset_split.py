@@ -0,0 +1,31 @@
+from src.scripts.dataset_split import is_train_video
+
+
+def test_split_is_deterministic():
+    assert [is_train_video(i, 0.8) for i in range(100)] == [
+        is_train_video(i, 0.8) for i in range(100)
+    ]
+
+
+def test_split_follows_the_ratio():
+    train = sum(is_train_video(i, 0.8) for i in range(10000))
+    assert 7700 < train < 8300
+    assert not any(is_train_video(i, 0.0) for i in range(100))
+    assert all(is_train_video(i, 1.0) for i in range(100))
+
+
+def test_raising_the_ratio_only_moves_videos_to_train():
+    for i in range(1000):
+        if is_train_video(i, 0.5):
+            assert is_train_video(i, 0.7)
+
+
+def test_salt_draws_a_new_split():
+    unsalted = [is_train_video(i, 0.5) for i in range(200)]
+    salted = [is_train_video(i, 0.5, "v2") for i in range(200)]
+    assert unsalted != salted
+
+
+def test_split_of_known_ids():
+    # changing the hash would move videos of earlier runs to the other split
+    assert [i for i in range(20) if is_train_video(i, 0.5)] == [0, 1, 4, 5, 6, 7, 8, 9, 11, 13, 15]
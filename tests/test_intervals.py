@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.scripts.intervals import IntervalSet, segment_ranges
+
+
+def frames(interval_set: IntervalSet) -> set:
+    return {f for start, end in interval_set for f in range(start, end + 1)}
+
+
+def random_ranges(rng: random.Random, n: int, hi: int = 100) -> list:
+    ranges = []
+    for _ in range(n):
+        start = rng.randint(0, hi)
+        ranges.append([start, start + rng.randint(0, 10)])
+    return ranges
+
+
+def test_from_ranges_merges_overlapping_and_touching():
+    merged = IntervalSet.from_ranges([[10, 12], [0, 3], [4, 5], [11, 20], [30, 30]])
+    assert merged.to_list() == [[0, 5], [10, 20], [30, 30]]
+
+
+def test_from_ranges_drops_ranges_outside_within():
+    merged = IntervalSet.from_ranges([[0, 5], [8, 12], [20, 25]], within=(0, 10))
+    assert merged.to_list() == [[0, 5]]
+
+
+def test_empty_set():
+    empty = IntervalSet.from_ranges([])
+    assert len(empty) == 0
+    assert empty.total_length() == 0
+    assert empty.complement(0, 9).to_list() == [[0, 9]]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_algebra_matches_frame_sets(seed):
+    rng = random.Random(seed)
+    a = IntervalSet.from_ranges(random_ranges(rng, rng.randint(0, 8)))
+    b = IntervalSet.from_ranges(random_ranges(rng, rng.randint(0, 8)))
+
+    assert frames(a.union(b)) == frames(a) | frames(b)
+    assert frames(a.intersection(b)) == frames(a) & frames(b)
+    assert frames(a.clip(20, 60)) == {f for f in frames(a) if 20 <= f <= 60}
+    assert frames(a.complement(0, 120)) == set(range(0, 121)) - frames(a)
+    assert a.total_length() == len(frames(a))
+    # results stay sorted, disjoint and non-adjacent
+    assert a.union(b) == IntervalSet.from_ranges(a.union(b).to_list())
+
+
+def test_segment_ranges_splits_into_near_equal_parts_longest_first():
+    segments = segment_ranges(np.array([0, 100]), np.array([9, 102]), 4)
+    assert segments.tolist() == [[0, 3], [4, 6], [7, 9], [100, 102]]
+
+
+@pytest.mark.parametrize("length,max_length", [(1, 5), (5, 5), (6, 5), (17, 4), (100, 7)])
+def test_segment_ranges_cover_the_range(length, max_length):
+    segments = segment_ranges(np.array([10]), np.array([10 + length - 1]), max_length)
+    lengths = segments[:, 1] - segments[:, 0] + 1
+    assert segments[0, 0] == 10 and segments[-1, 1] == 10 + length - 1
+    assert np.all(segments[1:, 0] == segments[:-1, 1] + 1)
+    assert lengths.max() <= max_length
+    assert lengths.max() - lengths.min() <= 1
+    assert list(lengths) == sorted(lengths, reverse=True)
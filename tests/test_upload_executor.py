@@ -0,0 +1,85 @@
+import threading
+import time
+
+from src.scripts.upload_executor import AdaptiveBatchSize, UploadExecutor
+
+
+def test_batch_size_grows_and_shrinks_by_at_most_two():
+    batch_size = AdaptiveBatchSize(initial=10, maximum=50, target_seconds=10.0)
+    batch_size.record(10, 1000, 1.0)
+    assert batch_size.next() == 20
+    batch_size.record(20, 2000, 100.0)
+    assert batch_size.next() == 10
+
+
+def test_batch_size_stays_within_bounds():
+    batch_size = AdaptiveBatchSize(initial=10, minimum=2, maximum=15, target_seconds=10.0)
+    batch_size.record(10, 1000, 1.0)
+    assert batch_size.next() == 15
+    for _ in range(5):
+        batch_size.record(2, 200, 100.0)
+    assert batch_size.next() == 2
+
+
+def test_batch_size_respects_max_bytes():
+    batch_size = AdaptiveBatchSize(initial=10, maximum=50, max_bytes=1000)
+    assert batch_size.next() == 10
+    batch_size.record(10, 2000, 10.0)
+    # 200 bytes per item
+    assert batch_size.next() == 5
+
+
+def test_empty_batches_are_ignored():
+    batch_size = AdaptiveBatchSize(initial=10)
+    batch_size.record(0, 0, 0.0)
+    assert batch_size.next() == 10
+    assert batch_size.item_bytes is None
+
+
+def test_results_are_handled_in_submission_order():
+    done = []
+    # later batches finish first
+    delays = [0.2, 0.1, 0.0, 0.05]
+    with UploadExecutor(workers=4) as executor:
+        for i, delay in enumerate(delays):
+            executor.submit(
+                lambda i, delay: time.sleep(delay) or i,
+                (i, delay),
+                lambda result, seconds: done.append(result),
+            )
+    assert done == [0, 1, 2, 3]
+
+
+def test_callbacks_run_on_the_submitting_thread_after_earlier_batches():
+    events = []
+    threads = set()
+
+    def on_done(result, seconds):
+        events.append(result)
+        threads.add(threading.get_ident())
+
+    with UploadExecutor(workers=2) as executor:
+        executor.submit(lambda: time.sleep(0.1) or "first", (), on_done)
+        executor.then(lambda: events.append("after first"))
+        executor.submit(lambda: "second", (), on_done)
+    assert events == ["first", "after first", "second"]
+    assert threads == {threading.get_ident()}
+
+
+def test_no_more_than_workers_batches_in_flight():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def upload():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    with UploadExecutor(workers=2) as executor:
+        for _ in range(6):
+            executor.submit(upload, (), lambda result, seconds: None)
+    assert max(peak) <= 2